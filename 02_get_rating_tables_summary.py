@@ -1,55 +1,86 @@
-import arcpy
 import os
 import pandas as pd
+from ssurgo_core.config import STATE_GPKG_DIR, STEP02_OUTPUT_DIR
+from ssurgo_core.gpkg import state_gpkg_path
+from ssurgo_core.reader import GpkgReader, GpkgQueryError
 
-""" use this script to get a summary table of all rating tables in all states, so if you a missing variable, go run portal again and get it"""
+""" use this script to get a summary table of all rating tables in all states, so if you a missing variable, go run portal again and get it
+tables are listed straight from sqlite_master of each gpkg (read-only, no arcpy); the queries of all states
+go through one GpkgReader, so the gpkgs are read at the same time"""
 
 
 # input
-database_path = r"B:\work_subset\projects\data\ssurgo_portal\02_gpkg_by_state_database"
+database_path = STATE_GPKG_DIR
 output_tablename = "rating_table_list_20260113.csv"
+output_stats_tablename = "rating_table_stats_20260113.csv"
+RATING_TABLES_SQL = "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'rating\\_%' ESCAPE '\\' ORDER BY name"
+TABLE_SIZE_SQL = "SELECT SUM(pgsize) FROM dbstat WHERE name = ?"
+N_THREADS = 8  # gpkgs read at the same time, sqlite releases the GIL so threads overlap the (network) reads
 
 # output
-workspace = os.path.dirname(os.path.abspath(__file__))
-output_directory = os.path.join(workspace,  "outputs", "v2", "02_rating_tables_list_in_all_gpkg")
-
-df_rating_tables = pd.DataFrame([])
-original_workspace = arcpy.env.workspace
-
-for folder in os.listdir(database_path):
-    state = folder.replace("_gpkg", "")
-    print(f"Processing {state}")
-    gpkg = os.path.join(database_path, folder, f"{state}.gpkg")
-    arcpy.env.workspace = gpkg
-    all_tables = arcpy.ListTables()     
-    rating_tables = [t for t in all_tables if t.startswith("main.rating_")]
-    if len(rating_tables) == 0:
-        print(f"No rating tables found for {state}")
-        continue
-    df_rating_table = pd.DataFrame({f"{state}": 'yes', "rating_tables": rating_tables})
-    df_rating_table = df_rating_table.set_index("rating_tables")
-    df_rating_tables = pd.merge(df_rating_tables, df_rating_table, left_index=True, right_index=True, how="outer")    
-    arcpy.env.workspace = original_workspace
-
-df_rating_tables.to_csv(os.path.join(output_directory, output_tablename), index=True)
-print(f"results see {output_tablename}")
-
-# print(df_rating_tables)
+output_directory = STEP02_OUTPUT_DIR
+
+
+def main():
+    folders = sorted(os.listdir(database_path))
+    with GpkgReader(max_workers=N_THREADS) as reader:
+        df_stats = read_gpkg_inventories(folders, reader)
+
+    # availability matrix: one row per rating table, one boolean column per state
+    df_rating_tables = pd.crosstab(df_stats['rating_tables'], df_stats['state']).astype(bool)
+    df_rating_tables.columns.name = None
+
+    os.makedirs(output_directory, exist_ok=True)
+    df_rating_tables.to_csv(os.path.join(output_directory, output_tablename), index=True)
+    df_stats.to_csv(os.path.join(output_directory, output_stats_tablename), index=False)
+    print(f"results see {output_tablename} and {output_stats_tablename}")
+
+
+def read_gpkg_inventories(folders, reader):
+    """List the rating tables of the state gpkgs with their row count and size on disk.
+
+    The table lists of all gpkgs are queried at once, then the counts and sizes of all their tables.
+    """
+    columns = ['state', 'rating_tables', 'row_count', 'size_bytes']
+    gpkgs = {}
+    for folder in folders:
+        state = folder.replace("_gpkg", "")
+        gpkg = state_gpkg_path(state, database_path)
+        if os.path.exists(gpkg):
+            gpkgs[state] = gpkg
+        else:
+            print(f"No gpkg found for {state}")
+
+    table_lists = {state: reader.submit(gpkg, RATING_TABLES_SQL) for state, gpkg in gpkgs.items()}
+    queries = {}
+    for state, table_list in table_lists.items():
+        print(f"Processing {state}")
+        table_names = [row[0] for row in table_list.result()]
+        if len(table_names) == 0:
+            print(f"No rating tables found for {state}")
+        for name in table_names:
+            queries[state, name] = (reader.submit(gpkgs[state], f'SELECT COUNT(*) FROM "{name}"'),
+                                    reader.submit(gpkgs[state], TABLE_SIZE_SQL, (name,)))
+
+    rows = [[state, f"main.{name}", row_count.result()[0][0], get_table_size(size)]
+            for (state, name), (row_count, size) in queries.items()]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def get_table_size(size_query):
+    # dbstat is an optional sqlite module, no size when it isn't compiled in
+    try:
+        return size_query.result()[0][0]
+    except GpkgQueryError:
+        return None
+
+
+if __name__ == '__main__':
+    main()
 
 # for state in df_rating_tables.columns:
 #     # print missing rating tables
-#     missing_rating_tables = df_rating_tables[df_rating_tables[state] != 'yes'].index.tolist()
+#     missing_rating_tables = df_rating_tables[~df_rating_tables[state]].index.tolist()
 #     print(f"\n\n{state}\n{', '.join(missing_rating_tables)}")
 
 # print("Done!")
-
-# print rating tables for one state
-# for state in ['Pennsylvania']:
-#     print(f"Processing {state}")
-#     gpkg = os.path.join(database_path, state + '_gpkg', f"{state}.gpkg")
-#     arcpy.env.workspace = gpkg
-#     all_tables = arcpy.ListTables()
-#     rating_tables = [t for t in all_tables if t.startswith("main.rating_")]
-#     for table in rating_tables:
-#         print(table)
-
@@ -1,67 +1,231 @@
+import re
+import glob
+import numpy as np
 import pandas as pd
 import sys
 import os
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from ssurgo_core.config import EXCEL_EXPORT_DIR, STATE_GPKG_DIR, MAPPING_EXCEL_FILE
+from ssurgo_core.gpkg import get_states_from_gpkglist, state_gpkg_path
+from ssurgo_core.reader import GpkgReader
 
 
 ''' this is to compare the soil variable values at different depths
-and to decide: what depth to use and which variable to use (Health or Physcial for example)'''
+and to decide: what depth to use and which variable to use (Health or Physcial for example)
 
+any variable family from the ssurgo/solus mapping workbook (e.g. omr_WA) is compared across
+DEPTHS: the depth columns are aligned on mukey in one join, and difference, correlation and
+agreement statistics are computed for every pair of columns at once. where the tables have a
+pctMU_<variable> column (share of the map unit) it is read and compared the same way, and a pair
+such as omr vs OrgMatter also gets the per mukey diff and diff_pctMU.
+all states are compared in the same run, in parallel: by default the rating_* tables are read
+straight from the state gpkgs (SOURCE = 'gpkg'), SOURCE = 'excel' uses the exported workbooks in
+input_dir instead. the aligned values of each comparison are written to one parquet file for all states.'''
 
-root = r'D:\work\data\ssurgo_download\DATABSE20251213_excel'
+
+root = EXCEL_EXPORT_DIR
 output_dir = os.path.join(root, 'output')
 input_dir = os.path.join(root, 'input')
+SOURCE = 'gpkg'  # 'gpkg' or 'excel'
+N_THREADS = 8  # states compared in parallel, the gpkg reads of all states share one GpkgReader
+mapping_excel_file = MAPPING_EXCEL_FILE
 
-def compare_sheets(excel_file):
-    pairs = [
-        ('omr_WA_0_4_cm', 'OrgMatter_WA_0_4_cm',
-         'omr_WA_0_4_cm', 'OrgMatter_WA_0_4_cm',
-         'pctMU_omr_WA_0_4_cm', 'pctMU_OrgMatter_WA_0_4_cm'),
-        
-        ('omr_WA_0_10_cm', 'OrgMatter_WA_0_10_cm',
-         'omr_WA_0_10_cm', 'OrgMatter_WA_0_10_cm',
-         'pctMU_omr_WA_0_10_cm', 'pctMU_OrgMatter_WA_0_10_cm'),
-        
-        ('omr_WA_SL', 'OrgMatter_WA_SL',
-         'omr_WA_SL', 'OrgMatter_WA_SL',
-         'pctMU_omr_WA_SL', 'pctMU_OrgMatter_WA_SL'),
-    ]
-    
-    all_sheets = pd.read_excel(excel_file, sheet_name=None)
-    results = []
-    
-    # compare two sets of organic matter
-    if True:
-        for sheet1, sheet2, val1, val2, pct1, pct2 in pairs:
-            print(f"\n{'='*60}")
-            print(f"Comparing: {sheet1} vs {sheet2}")
-            print('='*60)
-            
-            df1 = all_sheets[sheet1]
-            df2 = all_sheets[sheet2]
-            print(f"Number of NaN in {sheet1}: {df1.isna().sum().sum()}")
-            print(f"Number of NaN in {sheet2}: {df2.isna().sum().sum()}")
-            
-            var1 = sheet1
-            var2 = sheet2
-
-            df_merged = pd.merge(df1, df2, on='mukey')
-            df_merged = df_merged[['mukey', var1, var2, 'pctMU_'+var1, 'pctMU_'+var2]]
-            df_merged['diff'] = df_merged[var1] - df_merged[var2]
-            df_merged['diff_pctMU'] = df_merged['pctMU_'+var1] - df_merged['pctMU_'+var2]
-            df_merged.to_csv(os.path.join(output_dir, f'compare_{sheet1}.csv'))
-
-    if True:  # compare 4cm and 10cm and SL
-
-        df1 = all_sheets['omr_WA_0_4_cm'][['mukey', 'omr_WA_0_4_cm']]
-        df2 = all_sheets['omr_WA_0_10_cm'][['mukey', 'omr_WA_0_10_cm']]
-        df3 = all_sheets['omr_WA_0_20_cm'][['mukey', 'omr_WA_0_20_cm']]
-        df4 = all_sheets['omr_WA_SL'][['mukey', 'omr_WA_SL']]
-        df_merged = pd.merge(df1, df2, on='mukey')
-        df_merged = pd.merge(df_merged, df3, on='mukey')
-        df_merged = pd.merge(df_merged, df4, on='mukey')
-        df_merged.to_excel(os.path.join(output_dir, f'compare_depth.xlsx'))
+DEPTHS = ['0_5_cm', '25_30_cm', 'SL']
+AGREEMENT_RTOL = 0.05  # two values agree when they are within 5% of each other
+DEPTH_SUFFIX = re.compile(r'_(?:\d+_\d+_cm|SL)$')
 
-if __name__ == '__main__':
-    file_path = os.path.join(input_dir, 'nb.xlsx')
+# other comparisons, e.g. Health vs Physical organic matter at the same depth
+EXTRA_COMPARISONS = {
+    'omr_vs_OrgMatter_0_4_cm': ['omr_WA_0_4_cm', 'OrgMatter_WA_0_4_cm'],
+    'omr_vs_OrgMatter_0_10_cm': ['omr_WA_0_10_cm', 'OrgMatter_WA_0_10_cm'],
+    'omr_vs_OrgMatter_SL': ['omr_WA_SL', 'OrgMatter_WA_SL'],
+}
+
+
+def main():
+    families = get_variable_families(mapping_excel_file)
+    comparisons = {family: [f'{family}_{depth}' for depth in DEPTHS] for family in families}
+    comparisons.update(EXTRA_COMPARISONS)
+    print(f"comparing {', '.join(comparisons)} at depths {', '.join(DEPTHS)}")
+
+    if SOURCE == 'gpkg':
+        sources = {state: state_gpkg_path(state, STATE_GPKG_DIR) for state in get_states_from_gpkglist(STATE_GPKG_DIR)}
+    else:
+        sources = {os.path.splitext(os.path.basename(f))[0]: f for f in sorted(glob.glob(os.path.join(input_dir, '*.xlsx')))}
+
+    with GpkgReader(max_workers=N_THREADS) as reader, ThreadPoolExecutor(max_workers=N_THREADS) as pool:
+        results = list(pool.map(compare_state, sources.keys(), sources.values(), [comparisons] * len(sources),
+                                [reader] * len(sources)))
+    failed = [state for state, state_results in zip(sources, results) if state_results is None]
+    results = [state_results or {} for state_results in results]
+
+    # one columnar output per comparison with the aligned values of all states
+    os.makedirs(output_dir, exist_ok=True)
+    all_stats = []
+    for name in comparisons:
+        aligned = [state_results[name][0].reset_index().assign(state=state)
+                   for state, state_results in zip(sources, results) if name in state_results]
+        if len(aligned) == 0:
+            continue
+        pd.concat(aligned, ignore_index=True).to_parquet(os.path.join(output_dir, f'compare_{name}.parquet'), index=False)
+        all_stats += [state_results[name][1].assign(state=state, comparison=name)
+                      for state, state_results in zip(sources, results) if name in state_results]
+
+    if failed:
+        print(f"WARNING: {len(failed)} states failed and are not in the results: {', '.join(failed)}")
+    if len(all_stats) == 0:
+        print("no state has two of the variables of any comparison, nothing to write")
+        return
+
+    df_all_stats = pd.concat(all_stats, ignore_index=True)
+    df_all_stats = df_all_stats[['state', 'comparison'] + [c for c in df_all_stats.columns if c not in ('state', 'comparison')]]
+    df_all_stats.to_csv(os.path.join(output_dir, 'compare_depth_stats.csv'), index=False)
+    print(f"results see {os.path.join(output_dir, 'compare_depth_stats.csv')}")
+
+
+def compare_state(state, source_path, comparisons, reader):
+    """Run all comparisons for one state; the gpkg (through reader) or workbook is opened once for all of them.
+
+    A state that fails (e.g. GpkgQueryError on a broken gpkg) is reported and returns None, the other states go on.
+    """
+    print(f"Processing {state}")
+    if not os.path.exists(source_path):
+        print(f"   {source_path} not found, skipped")
+        return {}
+    try:
+        return compare_state_source(state, source_path, comparisons, reader)
+    except Exception as e:
+        print(f"   WARNING: {state} failed. {e}")
+        return None
+
+
+def compare_state_source(state, source_path, comparisons, reader):
+    results = {}
+    is_gpkg = source_path.endswith('.gpkg')
+    if is_gpkg:
+        table_names = set(reader.table_names(source_path, prefix='rating_'))
+    source = nullcontext() if is_gpkg else pd.ExcelFile(source_path)
+    with source:
+        for name, variables in comparisons.items():
+            if is_gpkg:
+                df_aligned = read_variables_from_gpkg(reader, source_path, table_names, variables)
+            else:
+                df_aligned = read_variables_from_excel(source, variables)
+            value_columns = [var for var in variables if var in df_aligned.columns]
+            if len(value_columns) < 2:
+                print(f"   {state} {name}: fewer than 2 of {', '.join(variables)}, skipped")
+                continue
+            results[name] = (df_aligned, compare_aligned(df_aligned, value_columns))
+    return results
+
+
+def compare_aligned(df_aligned, value_columns):
+    """compare_columns of the values and, where the tables have them, of their pctMU_ columns.
+
+    For a pair (e.g. omr vs OrgMatter) the per-mukey diff and diff_pctMU are added to df_aligned.
+    """
+    pct_columns = [pct_column(var) for var in value_columns if pct_column(var) in df_aligned.columns]
+    stats = compare_columns(df_aligned[value_columns])
+    if len(pct_columns) >= 2:
+        stats = pd.concat([stats, compare_columns(df_aligned[pct_columns])], ignore_index=True)
+    if len(value_columns) == 2:
+        df_aligned['diff'] = df_aligned[value_columns[0]] - df_aligned[value_columns[1]]
+        if len(pct_columns) == 2:
+            df_aligned['diff_pctMU'] = df_aligned[pct_columns[0]] - df_aligned[pct_columns[1]]
+    return stats
 
-    compare_sheets(file_path)
\ No newline at end of file
+
+def pct_column(var):
+    # share of the map unit the rating applies to, next to the value in some rating tables/sheets
+    return f'pctMU_{var}'
+
+
+def read_variables_from_gpkg(reader, gpkg_path, table_names, variables):
+    """Read mukey, value and pctMU_<variable> (if the table has it) of the rating_<variable> tables that exist
+    in the gpkg, aligned on mukey in one join.
+
+    The tables are queried at the same time through reader.
+    """
+    queries = {}
+    for var in variables:
+        if f'rating_{var}' not in table_names:
+            continue
+        table_columns = {row[1] for row in reader.query(gpkg_path, f'PRAGMA table_info("rating_{var}")')}
+        value_columns = [var] + ([pct_column(var)] if pct_column(var) in table_columns else [])
+        select = ', '.join(f'"{col}"' for col in value_columns)
+        queries[tuple(value_columns)] = reader.submit(gpkg_path, f'SELECT mukey, {select} FROM "rating_{var}"')
+    columns = {}
+    for value_columns, query in queries.items():
+        df = pd.DataFrame(query.result(), columns=['mukey', *value_columns]).set_index('mukey')
+        df.index = pd.to_numeric(df.index, errors='coerce')
+        df = df[df.index.notna()]
+        columns.update({col: pd.to_numeric(df[col], errors='coerce') for col in value_columns})
+    if len(columns) == 0:
+        return pd.DataFrame()
+    return align_on_mukey(columns)
+
+
+def get_variable_families(mapping_excel_file):
+    """Variable families (ssurgo name without the depth suffix) of the depth dependent ssurgo variables."""
+    ssurgo = pd.read_excel(mapping_excel_file, sheet_name='mapping', usecols=['ssurgo'])['ssurgo'].dropna()
+    with_depth = ssurgo[ssurgo.str.contains(DEPTH_SUFFIX)]
+    return sorted(with_depth.str.replace(DEPTH_SUFFIX, '', regex=True).unique())
+
+
+def read_variables_from_excel(excel_file, variables):
+    """Read only the sheets (one per variable) and columns needed (value and pctMU_), aligned on mukey in one join."""
+    sheet_names = excel_file.sheet_names
+    variables = [v for v in variables if v in sheet_names]
+    if len(variables) == 0:
+        return pd.DataFrame()
+    wanted = {'mukey', *variables, *(pct_column(var) for var in variables)}
+    sheets = pd.read_excel(excel_file, sheet_name=variables, usecols=lambda col: col in wanted)
+    return align_on_mukey({col: sheets[var].set_index('mukey')[col] for var in variables
+                           for col in [var, pct_column(var)] if col in sheets[var].columns})
+
+
+def align_on_mukey(columns):
+    # one outer join on the mukey index for all columns; statistics use the mukeys both columns have
+    columns = {var: column[~column.index.duplicated()] for var, column in columns.items()}
+    df_aligned = pd.concat(columns, axis=1, join='outer')
+    df_aligned.index.name = 'mukey'
+    return df_aligned
+
+
+def compare_columns(df_aligned, rtol=AGREEMENT_RTOL):
+    """Difference, correlation and agreement statistics for every pair of columns, as one row per pair.
+
+    All pairs are computed together on (mukey, column, column) arrays; each pair uses the mukeys
+    where both columns have a value.
+    """
+    values = df_aligned.to_numpy(dtype=np.float64)
+    valid = ~np.isnan(values)
+    both = valid[:, :, None] & valid[:, None, :]
+    diff = np.where(both, values[:, :, None] - values[:, None, :], 0.)
+    n_common = both.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_diff = diff.sum(axis=0) / n_common
+        mean_abs_diff = np.abs(diff).sum(axis=0) / n_common
+        rmse = np.sqrt((diff ** 2).sum(axis=0) / n_common)
+        agree = np.abs(diff) <= rtol * np.maximum(np.abs(values[:, :, None]), np.abs(values[:, None, :]))
+        pct_agree = (agree & both).sum(axis=0) / n_common * 100
+    corr = df_aligned.corr().to_numpy()
+
+    first, second = np.triu_indices(len(df_aligned.columns), k=1)
+    return pd.DataFrame({
+        'variable_1': df_aligned.columns[first],
+        'variable_2': df_aligned.columns[second],
+        'n_1': valid.sum(axis=0)[first],
+        'n_2': valid.sum(axis=0)[second],
+        'n_common': n_common[first, second],
+        'mean_diff': mean_diff[first, second],
+        'mean_abs_diff': mean_abs_diff[first, second],
+        'rmse': rmse[first, second],
+        'pearson_r': corr[first, second],
+        'pct_agree': pct_agree[first, second],
+    })
+
+
+if __name__ == '__main__':
+    main()
@@ -1,144 +1,243 @@
 import os
+import sys
 import time
-import arcpy
-import sqlite3
 import numpy as np
 import pandas as pd
-from pathlib import Path
-from collections import defaultdict
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ssurgo_core import PRIMARY_KEY_FIELD
+from ssurgo_core.config import STATE_GPKG_DIR, POINTS_FC, EXTRA_POINT_SETS, STEP02_OUTPUT_DIR, STEP04_OUTPUT_DIR
+from ssurgo_core.gpkg import get_state_gpkg_path, get_state_gpkg_size, get_states_from_gpkglist, state_gpkg_path
+from ssurgo_core.pipeline import core_fingerprint, fingerprint_path, hash_params, load_json, parse_stages, write_json
+from ssurgo_core.profiling import profile_stage, get_records, add_records, write_run_report
+from ssurgo_core.spatial import load_points, load_point_states, read_point_fields, spatial_join_many
+from ssurgo_core.dedup import find_duplicate_keys, resolve_duplicates
+from ssurgo_core.store import build_store
+from ssurgo_core.reader import GpkgReader
+from ssurgo_core.ratings import read_rating_tables, get_rating_name, load_rating_availability, build_read_plan
+from ssurgo_core.schema import apply_schema, arrow_schema
 t0 = time.time()
-arcpy.env.overwriteOutput = True
 
 ''' this script is used to extract all rating tables from the SSURGO database into a new gdb.
 input data: 
-1. nri data points with projection and ssurgo gpkg for each state
+1. nri data points with projection and ssurgo gpkg for each state, plus any other point sets (sample designs)
+   in POINT_SETS: all sets are joined in one pass, each state's polygons and ratings are read once for all of them
 2. SSURGO database for each state
 3. a list of rating tables to extract (from 02_get_rating_tables_summary.py)    
 output: 
-1. gdb with all rating tables for each state
-2. csv file with all rating tables for all states 
+1. parquet dataset with all rating tables, partitioned by state
+2. parquet file with all rating tables for all states 
+   (for a point set other than nri, the same outputs go to point_sets/<name>/)
 Note this takes a while to run.
 
 process:
-1. spatial join nri data points with ssurgo gpkg for each state
+1. spatial join nri data points with MUPOLYGON in ssurgo gpkg for each state
+   (in-process STRtree point-in-polygon, no arcpy needed)
 2. extract all rating tables from the SSURGO database for each state
-3. merge all rating tables for all states into output_csv_path
+3. merge all rating tables for all states into output_parquet_path, one row per PrimaryKey:
+   points joined in several (overlapping) state gpkgs keep the row of their own state, see ssurgo_core.dedup
 '''
 
-# inputs
-PRIMARY_KEY_FIELD = "PrimaryKey"
-POINTS_FC = r"B:\work_subset\projects\src\ssurgo\inputs\nri66k_points.gdb\nri66k_state_prj_ssurgo" 
-STATE_GPKG_DIR = r"B:\work_subset\projects\data\ssurgo_portal\02_gpkg_by_state_database"
+# inputs (paths are set in ssurgo_core/config.py or with SSURGO_* environment variables)
+PRIMARY_POINT_SET = 'nri'
+POINT_SETS = {PRIMARY_POINT_SET: POINTS_FC, **EXTRA_POINT_SETS}  # name -> <gdb or gpkg>/<layer>, SSURGO_POINT_SETS adds sets
+RATING_AVAILABILITY_CSV = os.path.join(STEP02_OUTPUT_DIR, "rating_table_list_20260113.csv")  # from step 02
+N_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # states are extracted in parallel, one state per process
+N_READER_THREADS = 2  # the queries of a state share its gpkg connection, the next table is read while the last one is cached
+BATCH_SIZE = 500_000  # rows per record batch when the national table is read back, bounds the summary memory
 
-ROOT = os.path.dirname(os.path.abspath(__file__))
-OUTPUT_DIR = os.path.join(ROOT, "outputs", 'v2', '04_rating_tables_all_variables')
-output_csv_path = os.path.join(OUTPUT_DIR, 'ssurgo_ratings_all_variables_all_states.csv')
+OUTPUT_DIR = STEP04_OUTPUT_DIR
+output_parquet_path = os.path.join(OUTPUT_DIR, 'ssurgo_ratings_all_variables_all_states.parquet')
 output_summary_excel = os.path.join(OUTPUT_DIR, 'ssurgo_ratings_all_variables_all_states_summary.xlsx')
-output_missing_primarykeys_fc = os.path.join(OUTPUT_DIR, 'ssurgo_missing_primarykeys.gdb', 'ssurgo_missing_primarykeys')
-
-output_temp_state_csv_dir = os.path.join(OUTPUT_DIR, 'ssurgo_csv_by_state')
-output_temp_gdb_path = os.path.join(OUTPUT_DIR, 'temp_extract_ssurgo.gdb')
-
-
-def main():
+output_missing_primarykeys_fc = os.path.join(OUTPUT_DIR, 'ssurgo_missing_primarykeys.gpkg')
+output_duplicates_csv = os.path.join(OUTPUT_DIR, 'duplicate_primarykeys.csv')  # points joined in more than one state
+output_store_dir = os.path.join(OUTPUT_DIR, 'ssurgo_ratings_store')  # memory mapped copy for lookups by PrimaryKey/mukey
+
+output_state_dataset_dir = os.path.join(OUTPUT_DIR, 'ssurgo_ratings_by_state')  # hive partitioned: state=<state>/part-0.parquet
+output_state_manifest = os.path.join(OUTPUT_DIR, 'state_manifest.json')  # done/failed status per state, for resuming
+output_rating_cache_dir = os.path.join(OUTPUT_DIR, 'rating_cache')  # one sqlite per state with mukey -> rating columns
+output_run_report_dir = os.path.join(OUTPUT_DIR, 'run_reports')  # time, memory and rows per stage/state/table of every run
+# the outputs above are those of the nri points, see get_output_path for the other point sets
+
+RATING_TABLES = ['main.rating_BdSurf_WA_0_5_cm',    
+    'main.rating_BdSurf_WA_25_30_cm',
+    'main.rating_BdSurf_WA_SL',
+    'main.rating_CEC7_WA_0_5_cm',
+    'main.rating_CEC7_WA_25_30_cm',
+    'main.rating_CEC7_WA_SL',
+    'main.rating_Clay_WA_0_5_cm',
+    'main.rating_Clay_WA_25_30_cm',
+    'main.rating_Clay_WA_SL',
+    'main.rating_Dep2AnyRes_WA',
+    'main.rating_Dep2BedRS_WA',
+    'main.rating_Dep2WatTbl_WA_jan_dec',
+    'main.rating_EcoSiteID_DCD',
+    'main.rating_EcoSiteNm_DCD',
+    'main.rating_Sand_WA_0_5_cm',
+    'main.rating_Sand_WA_25_30_cm',
+    'main.rating_Sand_WA_SL',
+    'main.rating_omr_WA_0_5_cm',
+    'main.rating_omr_WA_25_30_cm',          
+    'main.rating_omr_WA_SL',
+    'main.rating_pHSurf_WA_0_5_cm',
+    'main.rating_pHSurf_WA_25_30_cm',   
+    'main.rating_pHSurf_WA_SL',
+]
+
+
+STAGES = ['extract', 'summary']  # python 04_...py [extract] [summary], both when none is given
+
+
+def main(stages=STAGES):
     create_output_directories()
-    RATING_TABLES = ['main.rating_BdSurf_WA_0_5_cm',    
-        'main.rating_BdSurf_WA_25_30_cm',
-        'main.rating_BdSurf_WA_SL',
-        'main.rating_CEC7_WA_0_5_cm',
-        'main.rating_CEC7_WA_25_30_cm',
-        'main.rating_CEC7_WA_SL',
-        'main.rating_Clay_WA_0_5_cm',
-        'main.rating_Clay_WA_25_30_cm',
-        'main.rating_Clay_WA_SL',
-        'main.rating_Dep2AnyRes_WA',
-        'main.rating_Dep2BedRS_WA',
-        'main.rating_Dep2WatTbl_WA_jan_dec',
-        'main.rating_EcoSiteID_DCD',
-        'main.rating_EcoSiteNm_DCD',
-        'main.rating_Sand_WA_0_5_cm',
-        'main.rating_Sand_WA_25_30_cm',
-        'main.rating_Sand_WA_SL',
-        'main.rating_omr_WA_0_5_cm',
-        'main.rating_omr_WA_25_30_cm',          
-        'main.rating_omr_WA_SL',
-        'main.rating_pHSurf_WA_0_5_cm',
-        'main.rating_pHSurf_WA_25_30_cm',   
-        'main.rating_pHSurf_WA_SL',
-        ]
-
-    print(f"Number of rating tables to extract: {len(RATING_TABLES)}")   
-    
-    if False: 
 
+    if 'extract' in stages:
+        print(f"Number of rating tables to extract: {len(RATING_TABLES)}")
+        check_point_sets(POINT_SETS)
         state_list = get_states_from_gpkglist(STATE_GPKG_DIR)
-
-        for i, state in enumerate(state_list):
-            print(f'processing {state} {i+1}/{len(state_list)}')
-
-            sjoin_output = os.path.join(output_temp_gdb_path, f'{state}_sj')
-            state_rating_results_csv  = os.path.join(output_temp_state_csv_dir, f'{state}_rating.csv')
-            os.makedirs(os.path.join(OUTPUT_DIR, 'state_csv'), exist_ok=True)
-
-            if not os.path.exists(state_rating_results_csv):
-                gpkg_path, soil_poly =  get_state_gpkg_path(state, STATE_GPKG_DIR)
-                spatial_join(POINTS_FC, soil_poly, output_temp_gdb_path, sjoin_output)
-                state_df = read_ratings(RATING_TABLES, gpkg_path, state, sjoin_output, state_rating_results_csv)         
-    
-        # merge
-        rating_all_states = pd.DataFrame()
-        for i, state in enumerate(state_list):
-            state_csv  = os.path.join(output_temp_state_csv_dir, f'{state}_rating.csv')
-            if not os.path.exists(state_csv):            
-                raise FileNotFoundError(f"Missing CSV file for state {state}: {state_csv}")
-            else:    
-                state_df = pd.read_csv(state_csv)
-                rating_all_states = pd.concat([state_df, rating_all_states], ignore_index=True)
-
-        rating_all_states.to_csv(output_csv_path, index=False)
-
-    summarize_rating_data(output_csv_path, POINTS_FC, output_summary_excel)
-    
+        availability = None
+        if os.path.exists(RATING_AVAILABILITY_CSV):
+            availability, _ = load_rating_availability(RATING_AVAILABILITY_CSV)
+        else:
+            print(f"WARNING: no rating availability table {RATING_AVAILABILITY_CSV}, reading every table in every state")
+        manifest = extract_states_parallel(state_list, RATING_TABLES, POINT_SETS, N_WORKERS, availability)
+        failed = [state for state in state_list if manifest.get(state, {}).get('status') != 'done']
+        if failed:
+            # no national table from a partial extraction, the run must fail so the pipeline reruns the step
+            raise RuntimeError(f"{len(failed)} states not extracted (see {output_state_manifest}): {', '.join(failed)}")
+
+        # merge, one national table per point set
+        for point_set, points_fc in POINT_SETS.items():
+            for i, state in enumerate(state_list):
+                state_parquet = state_parquet_path(state, point_set)
+                if not os.path.exists(state_parquet):
+                    raise FileNotFoundError(f"Missing parquet file for state {state}: {state_parquet}")
+
+            parquet_path = get_output_path(point_set, output_parquet_path)
+            with profile_stage('merge_point_set', point_set=point_set):
+                merge_states_streaming(state_list, parquet_path, load_point_states(points_fc), point_set)
+                build_store(parquet_path, get_output_path(point_set, output_store_dir))
+
+    if 'summary' in stages:
+        for point_set, points_fc in POINT_SETS.items():
+            points_gdf = load_points(points_fc)
+            parquet_path = get_output_path(point_set, output_parquet_path)
+            with profile_stage('summarize_rating_data', rows_in=pq.ParquetFile(parquet_path).metadata.num_rows,
+                               point_set=point_set):
+                summarize_rating_data(parquet_path, points_gdf, get_output_path(point_set, output_summary_excel),
+                                      get_output_path(point_set, output_missing_primarykeys_fc))
+
+    write_run_report(output_run_report_dir, 'step04', t0, stages=list(stages))
     t1 = time.time()
-    runtime = (t1 - t0) / 60.    
+    runtime = (t1 - t0) / 60.
     print(f"\n Done. Time taken: {runtime:.2f} minutes")
-    
 
-def summarize_rating_data(csv_path, points_fc, output_summary_excel):
+
+def check_point_sets(point_sets):
+    # checked before the extraction, a point set that can't be merged would otherwise only fail after all states
+    for name, points_fc in point_sets.items():
+        fields = read_point_fields(points_fc)
+        if PRIMARY_KEY_FIELD not in fields:
+            raise ValueError(f"point set {name} ({points_fc}) has no {PRIMARY_KEY_FIELD} field")
+        if 'STATE_NAME' not in fields:
+            print(f"WARNING: point set {name} has no STATE_NAME field, its points joined in several states "
+                  f"keep the row with the fewest nulls")
+
+
+def merge_states_streaming(state_list, parquet_path, point_states, point_set=PRIMARY_POINT_SET):
+    """Append the state partitions to one national parquet file, with only one state in memory at a time.
+
+    The PrimaryKey columns are read first to find the points joined in more than one state. Their
+    rows are held back while the states are appended, then reduced to one row per point with
+    resolve_duplicates and written last; the conflicts go to output_duplicates_csv.
+    """
+    keys = pd.concat([pq.read_table(state_parquet_path(state, point_set), columns=[PRIMARY_KEY_FIELD], partitioning=None)
+                      .column(0).to_pandas() for state in state_list], ignore_index=True)
+    # a state without points of this set can have a null typed PrimaryKey, the writer takes the type of the others
+    key_types = [pq.read_schema(state_parquet_path(state, point_set)).field(PRIMARY_KEY_FIELD).type for state in state_list]
+    key_type = next((key_type for key_type in key_types if not pa.types.is_null(key_type)), pa.string())
+    duplicate_keys = find_duplicate_keys(keys)
+    print(f'{len(duplicate_keys)} PrimaryKeys joined in more than one state')
+
+    writer = None
+    duplicate_tables = []
+    with profile_stage('merge_states', rows_in=len(keys)) as record:
+        record['rows_out'] = 0
+        try:
+            for state in state_list:
+                table = pq.read_table(state_parquet_path(state, point_set), partitioning=None)
+                state_column = pa.DictionaryArray.from_arrays(
+                    pa.array(np.zeros(table.num_rows, dtype=np.int32)), pa.array([state]))
+                table = table.append_column('state', state_column)
+                if writer is None:
+                    schema = arrow_schema(table.schema)  # int32 mukey, float32 ratings, dictionary text
+                    schema = schema.set(schema.get_field_index(PRIMARY_KEY_FIELD), pa.field(PRIMARY_KEY_FIELD, key_type))
+                    writer = pq.ParquetWriter(parquet_path, schema, compression='zstd')
+                table = table.cast(schema)
+                is_duplicate = pc.is_in(table[PRIMARY_KEY_FIELD],
+                                        value_set=pa.array(duplicate_keys.to_numpy(), type=schema.field(PRIMARY_KEY_FIELD).type))
+                duplicate_tables.append(table.filter(is_duplicate))
+                table = table.filter(pc.invert(is_duplicate))
+                writer.write_table(table)
+                record['rows_out'] += table.num_rows
+
+            duplicates_df = pa.concat_tables(duplicate_tables).to_pandas()
+            rating_columns = [col for col in duplicates_df.columns if col not in (PRIMARY_KEY_FIELD, 'mukey', 'state')]
+            kept_df, conflict_report = resolve_duplicates(duplicates_df, point_states, rating_columns)
+            writer.write_table(pa.Table.from_pandas(kept_df, preserve_index=False).cast(schema))
+            record['rows_out'] += len(kept_df)
+            print(f'kept one of {len(duplicates_df)} rows for {len(kept_df)} PrimaryKeys, '
+                  f'by rule: {conflict_report["rule"].value_counts().to_dict()}, '
+                  f'{int(conflict_report["values_differ"].sum())} with different ratings between states')
+            conflict_report.to_csv(get_output_path(point_set, output_duplicates_csv), index=False)
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+def summarize_rating_data(parquet_path, points_gdf, output_summary_excel, output_missing_fc=output_missing_primarykeys_fc):
     # two outputs:
     # 1. summary excel file
     # 2. feature class for missing primary keys
+    # the national table is read in record batches and the missing counts are accumulated,
+    # so memory is bounded by BATCH_SIZE rows, not by the whole table
+    parquet_file = pq.ParquetFile(parquet_path)
+    n_rows = parquet_file.metadata.num_rows
     
     # get total primary keys from points fc and missing keys
-    df = pd.read_csv(csv_path)
-    data = []
-    with arcpy.da.SearchCursor(points_fc, [PRIMARY_KEY_FIELD]) as cursor:
-        for row in cursor:
-            data.append(list(row))
-    total_primarykeys_df = pd.DataFrame(data, columns=[PRIMARY_KEY_FIELD])
-
-    missing_primarykeys = total_primarykeys_df[~total_primarykeys_df.PrimaryKey.isin(df.PrimaryKey)]
+    primary_keys = parquet_file.read(columns=[PRIMARY_KEY_FIELD]).column(0).to_pandas()
+    total_primarykeys_df = points_gdf[[PRIMARY_KEY_FIELD]]
+
+    missing_primarykeys = total_primarykeys_df[~total_primarykeys_df.PrimaryKey.isin(primary_keys)]
     print(f'\nnumber of PrimaryKey in points fc: {len(total_primarykeys_df)}, unique number of PrimaryKey: {len(total_primarykeys_df.PrimaryKey.unique())}')
-    print(f'number of PrimaryKey in final table: {len(df)}, unique number of PrimaryKey: {len(df.PrimaryKey.unique())}')
+    print(f'number of PrimaryKey in final table: {n_rows}, unique number of PrimaryKey: {len(primary_keys.unique())}')
     print(f'number of primary keys in points fc but not in final table: {len(missing_primarykeys)}')
 
-    missing_primarykeys.to_csv(os.path.join(OUTPUT_DIR, 'missing_primarykeys.csv'), index=True)    
-    gdb_parent = os.path.dirname(points_fc)
-    gdb_name = os.path.basename(points_fc)
-    gdf = gpd.read_file(gdb_parent, layer=gdb_name)
-    missing_gdf = gdf[~gdf[PRIMARY_KEY_FIELD].isin(df[PRIMARY_KEY_FIELD])]
-    missing_gdf.to_file(output_missing_primarykeys_fc, driver='GPKG')
+    missing_primarykeys.to_csv(os.path.join(os.path.dirname(output_summary_excel), 'missing_primarykeys.csv'), index=True)    
+    missing_gdf = points_gdf[~points_gdf[PRIMARY_KEY_FIELD].isin(primary_keys)]
+    missing_gdf.to_file(output_missing_fc, layer='ssurgo_missing_primarykeys', driver='GPKG')
+
+    # accumulate per state point and missing counts batch by batch
+    variables = [col for col in parquet_file.schema_arrow.names if col not in ['PrimaryKey', 'mukey', 'state']]   
+    state_counts = pd.Series(dtype=np.int64)
+    state_missing_count = pd.DataFrame(columns=variables, dtype=np.int64)
+    for batch in parquet_file.iter_batches(batch_size=BATCH_SIZE, columns=variables + ['state']):
+        chunk = batch.to_pandas()
+        state_counts = state_counts.add(chunk.groupby('state', observed=True).size(), fill_value=0)
+        state_missing_count = state_missing_count.add(
+            chunk[variables].isnull().groupby(chunk['state'], observed=True).sum(), fill_value=0)
+    state_counts = state_counts.astype(np.int64)
+    state_missing_count = state_missing_count.astype(np.int64)
 
     # get missing variables
-    variables = [col for col in df.columns if col not in ['PrimaryKey', 'mukey', 'state']]   
-    missing_vars = df[variables].isnull().sum().to_frame(name='Missing_Count')
-    missing_vars['Missing_Percent'] = (missing_vars['Missing_Count'] / len(df) * 100).round(2)
+    missing_vars = state_missing_count.sum().to_frame(name='Missing_Count')
+    missing_vars['Missing_Percent'] = (missing_vars['Missing_Count'] / n_rows * 100).round(2)
     missing_vars = missing_vars.sort_values(by='Missing_Count', ascending=False)
 
     # get state summary
-    state_counts = df['state'].value_counts().to_frame(name='Total_Points_Found')
-    state_missing_count = df.groupby('state')[variables].apply(lambda x: x.isnull().sum())
-    state_summary = state_counts.join(state_missing_count)
+    state_summary = state_counts.to_frame(name='Total_Points_Found').join(state_missing_count)
     # Add total missing count across all variables per state
     state_summary['Total_Missing'] = state_summary[variables].sum(axis=1)
     state_summary = state_summary.sort_values(by='Total_Missing', ascending=False)
@@ -151,120 +250,149 @@ def summarize_rating_data(csv_path, points_fc, output_summary_excel):
 
 
 
-def read_ratings(RATING_TABLES, gpkg_path, state, sjoin_output, rating_results_csv):
-
-    
-    data = []
-    with arcpy.da.SearchCursor(sjoin_output, [PRIMARY_KEY_FIELD, 'mukey']) as cursor:
-        for row in cursor:
-            data.append(list(row))
-    sp_join_df = pd.DataFrame(data, columns=[PRIMARY_KEY_FIELD, 'mukey'])
-        
-    for i, table_name in enumerate(RATING_TABLES):        
-        current_df = read_gpkg_table_to_df(gpkg_path, table_name)            
-        current_df['mukey'] = pd.to_numeric(current_df['mukey'], errors='coerce')
-        current_df = current_df[['mukey', table_name.replace('main.rating_', '')]]
-        
-        if i==0:
-            base_df = current_df
-        else:
-            base_df = pd.merge(base_df, current_df, on='mukey', how='outer')
-    
-    state_result_df = pd.merge(sp_join_df, base_df, on='mukey', how='left')
-    state_result_df['state'] = state
-    state_result_df = state_result_df.dropna(subset=['mukey'])
-    state_result_df.to_csv(rating_results_csv, index=False)
-
-    return state_result_df    
-    
-
-def get_states_from_gpkglist(STATE_GPKG_DIR):
-    gpkglist = os.listdir(STATE_GPKG_DIR)
-    states = [foldername.replace('_gpkg', '') for foldername in gpkglist]
-    return sorted(states)
-
-def spatial_join(point_fc, soil_poly, output_gdb_path, sjoin_output):
-
-    arcpy.analysis.SpatialJoin(
-        target_features=point_fc,
-        join_features=soil_poly,
-        out_feature_class=sjoin_output,
-        join_operation="JOIN_ONE_TO_ONE",
-        join_type="KEEP_ALL",
-        match_option="INTERSECT",
-        search_radius=None,
-        distance_field_name="",
-        match_fields=None)
-
-
-def get_state_gpkg_path(state_name, gpkg_dir):
-    gpkg_path = os.path.join(gpkg_dir, f"{state_name}_gpkg", f"{state_name}.gpkg")
-    if not os.path.exists(gpkg_path):
-        raise FileNotFoundError(f"GPKG not found for {state_name}")
-    
-    soil_poly = os.path.join(gpkg_path, "MUPOLYGON")
-    if not arcpy.Exists(soil_poly):
-        raise FileNotFoundError(f"'MUPOLYGON' not found in GPKG for {state_name}")
-    
-    return gpkg_path, soil_poly
-
-
-def get_states(points_fc):
-    states = set()
-    with arcpy.da.SearchCursor(points_fc, ["STATE_NAME"]) as cursor:
-        for row in cursor:
-            states.add(row[0])
-    state_list = sorted(list(states))
+def read_ratings(RATING_TABLES, gpkg_path, state, primary_keys, mukeys, rating_results_parquet, cache_path=None,
+                 read_plan=None, reader=None):
+    # read_plan: the rating tables that exist in this gpkg (see build_read_plan), the others come out all-null
+    # reader: the GpkgReader the gpkg is read through (see read_rating_tables)
+    return read_ratings_many(RATING_TABLES, gpkg_path, state, {None: (primary_keys, mukeys)},
+                             {None: rating_results_parquet}, cache_path, read_plan, reader)[None]
+
+
+def read_ratings_many(RATING_TABLES, gpkg_path, state, joins, rating_results_parquets, cache_path=None,
+                      read_plan=None, reader=None):
+    """read_ratings for several point sets: joins is {name: (PrimaryKey, mukey)} from spatial_join_many.
+
+    The rating tables are read once for the mukeys of all sets, then every set is joined against
+    them and written to its own parquet (rating_results_parquets[name]). Returns {name: DataFrame}.
+    """
+    all_mukeys = np.concatenate([mukeys for _, mukeys in joins.values()])
+    with profile_stage('read_ratings', rows_in=len(all_mukeys), state=state) as record:
+        tables_to_read = RATING_TABLES if read_plan is None else read_plan
+        ratings_df = read_rating_tables(gpkg_path, tables_to_read, all_mukeys, cache_path, reader, state)
+        ratings_df = ratings_df.reindex(columns=[get_rating_name(t) for t in RATING_TABLES])
+
+        state_results = {}
+        for name, (primary_keys, mukeys) in joins.items():
+            # one point join against the wide mukey x variable table
+            sp_join_df = pd.DataFrame({PRIMARY_KEY_FIELD: primary_keys, 'mukey': mukeys})
+            state_result_df = sp_join_df.join(ratings_df, on='mukey')
+            state_result_df['state'] = state
+            state_result_df = apply_schema(state_result_df)
+
+            # the state is the partition key (directory name), so it is not stored in the file itself
+            rating_results_parquet = rating_results_parquets[name]
+            os.makedirs(os.path.dirname(rating_results_parquet), exist_ok=True)
+            table = pa.Table.from_pandas(state_result_df.drop(columns='state'), preserve_index=False)
+            pq.write_table(table.cast(arrow_schema(table.schema)), rating_results_parquet, compression='zstd')
+            state_results[name] = state_result_df
+        record['rows_out'] = sum(len(df) for df in state_results.values())
+
+    return state_results
+
+
+def extract_states_parallel(state_list, rating_tables, point_sets, n_workers, availability=None):
+    """Run spatial join + read_ratings for each state on a process pool, for all point sets at once.
+
+    Largest gpkgs are submitted first so the slowest states don't end up as the tail of the run.
+    Each finished state is recorded in the manifest right away with a fingerprint of its gpkg,
+    the point sets, the rating tables and the ssurgo_core code, so a rerun only redoes the states that are not done or
+    whose inputs changed since.
+    """
+    manifest = load_json(output_state_manifest)
+    read_plans = {state: build_read_plan(availability, rating_tables, state) for state in state_list}
+    points_fingerprint = {name: fingerprint_path(points_fc) for name, points_fc in sorted(point_sets.items())}
+    code_fingerprint = core_fingerprint()  # a fix in ssurgo_core (spatial join, schema, ...) redoes the states
+    fingerprints = {state: hash_params(fingerprint_path(state_gpkg_path(state, STATE_GPKG_DIR)), points_fingerprint,
+                                       rating_tables, read_plans[state], code_fingerprint)
+                    for state in state_list}
+    todo = [state for state in state_list
+            if manifest.get(state, {}).get('status') != 'done' or manifest[state].get('fingerprint') != fingerprints[state]
+            or not all(os.path.exists(state_parquet_path(state, name)) for name in point_sets)]
+    print(f'{len(state_list) - len(todo)} states up to date, {len(todo)} to process with {n_workers} workers '
+          f'for {len(point_sets)} point sets ({", ".join(point_sets)})')
+    todo = sorted(todo, key=lambda state: get_state_gpkg_size(state, STATE_GPKG_DIR), reverse=True)
+    for state in todo:
+        # a state that fails again must not leave its old partitions behind to be merged
+        manifest.pop(state, None)
+        for name in point_sets:
+            if os.path.exists(state_parquet_path(state, name)):
+                os.remove(state_parquet_path(state, name))
+
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=(point_sets,)) as pool:
+        futures = {pool.submit(extract_state, state, rating_tables, read_plans[state]): state for state in todo}
+        for i, future in enumerate(as_completed(futures)):
+            state = futures[future]
+            try:
+                n_rows, seconds, records = future.result()
+                add_records(records)
+                manifest[state] = {'status': 'done', 'rows': n_rows, 'minutes': round(seconds / 60., 2),
+                                   'parquet': {name: state_parquet_path(state, name) for name in point_sets},
+                                   'fingerprint': fingerprints[state],
+                                   'unavailable': [t for t in rating_tables if t not in read_plans[state]]}
+                print(f'done {state} {i+1}/{len(todo)}: {n_rows} rows in {seconds / 60.:.2f} minutes')
+            except Exception as e:
+                manifest[state] = {'status': 'failed', 'error': repr(e)}
+                print(f'   WARNING: {state} failed {i+1}/{len(todo)}. {e}')
+            write_json(manifest, output_state_manifest)
+
+    failed = sorted(state for state in state_list if manifest.get(state, {}).get('status') != 'done')
+    if failed:
+        print(f'failed states (rerun to retry): {", ".join(failed)}')
+    return manifest
+
+
+_worker_point_sets = None
+
+
+def init_worker(point_sets):
+    # each worker process reads the point sets once and reuses them for all the states it gets
+    global _worker_point_sets
+    _worker_point_sets = {name: load_points(points_fc) for name, points_fc in point_sets.items()}
+
+
+def extract_state(state, rating_tables, read_plan=None):
+    # the polygons and ratings of the state are read once for all point sets
+    # the profiling records of this state go back to the parent with the result
+    start = time.time()
+    get_records(clear=True)
+    n_points = sum(len(points_gdf) for points_gdf in _worker_point_sets.values())
+    with profile_stage('extract_state', rows_in=n_points, state=state) as record, \
+            GpkgReader(max_workers=N_READER_THREADS) as reader:
+        gpkg_path, soil_poly = get_state_gpkg_path(state, STATE_GPKG_DIR)
+        joins = spatial_join_many(_worker_point_sets, gpkg_path, soil_poly)
+        state_dfs = read_ratings_many(rating_tables, gpkg_path, state, joins,
+                                      {name: state_parquet_path(state, name) for name in joins},
+                                      cache_path=rating_cache_path(state), read_plan=read_plan, reader=reader)
+        n_rows = {name: len(state_df) for name, state_df in state_dfs.items()}
+        record['rows_out'] = sum(n_rows.values())
+    return n_rows, time.time() - start, get_records(clear=True)
+
+
+def get_output_path(point_set, path):
+    # the nri points keep the outputs at the top of OUTPUT_DIR, every other point set gets the same files
+    # in point_sets/<name>/
+    if point_set == PRIMARY_POINT_SET:
+        return path
+    return os.path.join(OUTPUT_DIR, 'point_sets', point_set, os.path.relpath(path, OUTPUT_DIR))
+
+
+def state_parquet_path(state, point_set=PRIMARY_POINT_SET):
+    return get_output_path(point_set, os.path.join(output_state_dataset_dir, f'state={state}', 'part-0.parquet'))
+
+
+def rating_cache_path(state):
+    return os.path.join(output_rating_cache_dir, f'{state}.sqlite')
+
+
+def get_states(points_gdf):
+    state_list = sorted(points_gdf["STATE_NAME"].dropna().unique().tolist())
     return state_list
 
 
-def load_rating_availability(csv_path):    
-    df = pd.read_csv(csv_path)
-    
-    availability = {}
-    for idx, row in df.iterrows():
-        rating_table = row['rating_tables']
-        state_availability = {}
-        
-        for col in df.columns[1:]:  
-            
-            has_rating = str(row[col]).strip().lower() == 'yes'
-            state_availability[col] = has_rating
-        
-        availability[rating_table] = state_availability
-    
-    rating_tables_from_csv = df['rating_tables'].tolist()
-        
-    return availability, rating_tables_from_csv
-
-
-def read_gpkg_table_to_df(gpkg_path, table_name):
-    try:
-        conn = sqlite3.connect(gpkg_path)
-        df = pd.read_sql_query(f"SELECT * FROM {table_name}", conn)
-        conn.close()
-        return df
-    except Exception as e:
-        print(f"   WARNING: Could not read table '{table_name}' with sqlite3. {e}")
-        return None
-
-
-def ensure_gdb_exists(gdb_path):
-    """Create a file geodatabase if it doesn't exist."""
-    if not arcpy.Exists(gdb_path):
-        gdb_parent = os.path.dirname(gdb_path)
-        gdb_name = os.path.basename(gdb_path)
-        arcpy.management.CreateFileGDB(gdb_parent, gdb_name)
-
 def create_output_directories():
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR)
-    if not os.path.exists(output_temp_state_csv_dir):
-        os.makedirs(output_temp_state_csv_dir)
-    
-    ensure_gdb_exists(output_temp_gdb_path)
-    ensure_gdb_exists(os.path.dirname(output_missing_primarykeys_fc))
+    for point_set in POINT_SETS:
+        os.makedirs(get_output_path(point_set, output_state_dataset_dir), exist_ok=True)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(parse_stages(sys.argv[1:], STAGES))
\ No newline at end of file
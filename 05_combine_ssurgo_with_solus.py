@@ -1,162 +1,133 @@
 
 import os
-import arcpy
-import numpy as np
+import sys
+import time
 import pandas as pd
-import seaborn as sns
-import geopandas as gpd
-import matplotlib.pyplot as plt
-arcpy.env.overwriteOutput = True
+import pyarrow as pa
+import pyarrow.parquet as pq
+from ssurgo_core.config import SOLUS_FILE, POINTS_FC, MAPPING_EXCEL_FILE, STEP04_OUTPUT_DIR, STEP05_OUTPUT_DIR
+from ssurgo_core.fill import fill_ssurgo_with_solus, normalize_primary_keys
+from ssurgo_core.missing import create_missing_point_fc_from_parquet
+from ssurgo_core.distributions import print_summary_stats, plot_soil_distributions
+from ssurgo_core.profiling import profile_stage, write_run_report
+from ssurgo_core.store import build_store
+from ssurgo_core.pipeline import parse_stages
 """
 Combine SSURGO and SOLUS soil datasets.
 Fill missing values in SSURGO using corresponding SOLUS variables.
 Create plots
 """
 
-# inputs
-solus_file = r'B:\work_subset\projects\src\solus\outputs\v2\all_66k_values.xlsx'
-root = os.path.dirname(os.path.abspath(__file__))
-rating_all_states_file = os.path.join(root, 'outputs', 'v2', '04_rating_tables_all_variables',
-                                       'ssurgo_ratings_all_variables_all_states.csv')
-mapping_excel_file = os.path.join(root, 'soil_variables_mapping_between_ssurgo_solus.xlsx')
-
-# input for checking missing data points only
-POINTS_FC = r"B:\work_subset\projects\src\ssurgo\inputs\nri66k_points.gdb\nri66k_state_prj_ssurgo" 
+# inputs (paths are set in ssurgo_core/config.py or with SSURGO_* environment variables)
+solus_file = SOLUS_FILE
+rating_all_states_file = os.path.join(STEP04_OUTPUT_DIR, 'ssurgo_ratings_all_variables_all_states.parquet')
+mapping_excel_file = MAPPING_EXCEL_FILE
 
 # outputs
-output_dir = os.path.join(root,'outputs', 'v2', '05_combine_ssurgo_solus')
-output_excel_file_combined = os.path.join(output_dir, 'ssurgo_solus_combined.xlsx')
-output_excel_file_before_combine = os.path.join(output_dir, 'ssurgo_before_combine.xlsx')
+output_dir = STEP05_OUTPUT_DIR
+output_file_combined = os.path.join(output_dir, 'ssurgo_solus_combined.parquet')
+output_file_before_combine = os.path.join(output_dir, 'ssurgo_before_combine.parquet')
 output_excel_file_missing_filling_count= os.path.join(output_dir, 'missing_filling_count.xlsx')
+output_file_provenance = os.path.join(output_dir, 'ssurgo_solus_provenance.parquet')  # flags in ssurgo_core.fill
+output_missing_gpkg = os.path.join(output_dir, 'missing_datapoints.gpkg')
+output_store_dir = os.path.join(output_dir, 'ssurgo_solus_combined_store')  # memory mapped copy for lookups by PrimaryKey
+solus_parquet_file = os.path.join(output_dir, 'all_66k_values.parquet')  # one-time converted copy of solus_file
+output_run_report_dir = os.path.join(output_dir, 'run_reports')  # time, memory and rows per stage of every run
+
+# parquet is the handoff between steps; set to True to also get the excel copies at the end
+EXPORT_EXCEL = False
+BATCH_SIZE = 500_000  # ssurgo rows filled per record batch, bounds memory for the national table
+
+STAGES = ['fill', 'summary', 'missing']  # python 05_...py [fill] [summary] [missing], all when none is given
 
 os.makedirs(output_dir, exist_ok=True)
 
-def main():
+def main(stages=STAGES):
+    started = time.time()
 
     df_variable_mapping = pd.read_excel(mapping_excel_file, sheet_name='mapping')
     df_variable_mapping = df_variable_mapping[~df_variable_mapping.ssurgo.isna()]
     ssurgo_variables = df_variable_mapping.ssurgo.values
 
-
-    if False:
-        df_ssurgo = pd.read_csv(rating_all_states_file)
-        df_solus = pd.read_excel(solus_file)
-        df_ssurgo = df_ssurgo.set_index('PrimaryKey')
+    if 'fill' in stages:
+        convert_solus_excel_to_parquet(solus_file, solus_parquet_file)
+        df_solus = pd.read_parquet(solus_parquet_file)
         df_solus = df_solus.set_index('PrimaryKey')
+        df_solus.index = normalize_primary_keys(df_solus.index)  # once here, then a no-op in every batch
 
-        df_ssurgo_selected = df_ssurgo[ssurgo_variables].copy()
-        df_ssurgo_selected.reset_index().to_excel(output_excel_file_before_combine, index=False)
-
-        df_missing_filling_count = pd.DataFrame([], columns=ssurgo_variables, index=['missing_before', 'missing_after'])
-        for _, row in df_variable_mapping.iterrows():
-            ssurgo_col = row['ssurgo']
-            solus_col = row['solus']
-            multiplier = row['multiplier']
-            print(f"processing {ssurgo_col} {solus_col}...")
-
-            if ssurgo_col in df_ssurgo.columns and solus_col in df_solus.columns:
-                missing_before_filling = len(df_ssurgo_selected[df_ssurgo_selected[ssurgo_col].isna()])          
-                solus_values_adjusted = df_solus[solus_col] * multiplier                
-                df_ssurgo_selected[ssurgo_col] = df_ssurgo_selected[ssurgo_col].fillna(solus_values_adjusted)
-                missing_after_filling = len(df_ssurgo_selected[df_ssurgo_selected[ssurgo_col].isna()])
-                df_missing_filling_count[ssurgo_col]  = [missing_before_filling, missing_after_filling]
-                
-
-        df_ssurgo_selected.reset_index().to_excel(output_excel_file_combined, index=False)
+        df_missing_filling_count = fill_in_batches(rating_all_states_file, df_solus, df_variable_mapping, ssurgo_variables)
         df_missing_filling_count.to_excel(output_excel_file_missing_filling_count)
+        with profile_stage('build_store'):
+            build_store(output_file_combined, output_store_dir)
+
+    # plot, the statistics need all values of a variable so only the rating columns are read
+    if 'summary' in stages:
+        df = pd.read_parquet(output_file_combined, columns=list(ssurgo_variables))
+        with profile_stage('summary', rows_in=len(df)):
+            print_summary_stats(df, output_dir)
+            plot_soil_distributions(df, output_dir)
+        del df
+
+    # create fc, the missing bitmask is built batch by batch
+    if 'missing' in stages:
+        create_missing_point_fc_from_parquet(output_file_combined, POINTS_FC, ssurgo_variables, output_missing_gpkg, BATCH_SIZE)
+
+    if EXPORT_EXCEL:
+        export_excel([output_file_before_combine, output_file_combined])
+
+    write_run_report(output_run_report_dir, 'step05', started, stages=list(stages))
+    print(f"done")
+
+
+def fill_in_batches(ssurgo_file, df_solus, df_variable_mapping, ssurgo_variables):
+    """Run fill_ssurgo_with_solus over the national ssurgo table one record batch at a time.
+
+    Every batch is appended to the before-combine, combined and provenance parquet files, so only
+    BATCH_SIZE ssurgo rows are in memory at once. Returns the missing counts summed over the batches.
+    """
+    writers = {}
+    df_missing_filling_count = None
+    parquet_file = pq.ParquetFile(ssurgo_file)
+    with profile_stage('fill', rows_in=parquet_file.metadata.num_rows) as record:
+        record['rows_out'] = 0
+        try:
+            batches = parquet_file.iter_batches(batch_size=BATCH_SIZE, columns=['PrimaryKey', *ssurgo_variables])
+            for batch in batches:
+                df_ssurgo_selected = batch.to_pandas().set_index('PrimaryKey')[ssurgo_variables]
+                df_filled, batch_count, df_provenance = fill_ssurgo_with_solus(df_ssurgo_selected, df_solus, df_variable_mapping)
+
+                append_parquet(writers, output_file_before_combine, df_ssurgo_selected)
+                append_parquet(writers, output_file_combined, df_filled)
+                append_parquet(writers, output_file_provenance, df_provenance)
+                df_missing_filling_count = batch_count if df_missing_filling_count is None else df_missing_filling_count + batch_count
+                record['rows_out'] += len(df_filled)
+        finally:
+            for writer in writers.values():
+                writer.close()
+    return df_missing_filling_count
+
+
+def append_parquet(writers, parquet_path, df):
+    table = pa.Table.from_pandas(df.reset_index(), preserve_index=False)
+    if parquet_path not in writers:
+        writers[parquet_path] = pq.ParquetWriter(parquet_path, table.schema, compression='zstd')
+    writers[parquet_path].write_table(table.cast(writers[parquet_path].schema))
+
+
+def convert_solus_excel_to_parquet(excel_file, parquet_file):
+    # the solus workbook is parsed with openpyxl only once, or again when the workbook changes
+    if os.path.exists(parquet_file) and os.path.getmtime(parquet_file) >= os.path.getmtime(excel_file):
+        return
+    print(f"converting {excel_file} to {parquet_file}")
+    pd.read_excel(excel_file).to_parquet(parquet_file, index=False)
 
-    # plot
-    df = pd.read_excel(output_excel_file_combined)
-    # print_summary_stats(df)
-    # plot_soil_distributions(df)
-
-    # create fc
-    create_missing_point_fc(df, POINTS_FC, ssurgo_variables)
-
-    print(f"done")    
-
-
-def create_missing_point_fc(df, point_fc, ssurgo_variables):
-    gdb_path_source = os.path.dirname(point_fc)
-    layer_name = os.path.basename(point_fc)
-    gdf = gpd.read_file(gdb_path_source, layer=layer_name)
-
-    # gdb_name = 'missing_datapoints.gdb'
-    # missing_gdb = os.path.join(output_dir, gdb_name)
-
-    # if not arcpy.Exists(missing_gdb):
-    #     arcpy.management.CreateFileGDB(output_dir, gdb_name)
-
-    gpkg_path = os.path.join(output_dir, 'missing_datapoints.gpkg')
-
-    for var in ssurgo_variables:
-        missing_keys = df.loc[df[var].isna(), 'PrimaryKey']
-        missing_gdf = gdf[gdf['PrimaryKey'].isin(missing_keys)]        
-        missing_gdf.to_file(gpkg_path, layer=f"{var}_missing", driver='GPKG')
-
-        print(f"Exported missing points for {var}")
 
+def export_excel(parquet_files):
+    for parquet_file in parquet_files:
+        excel_file = os.path.splitext(parquet_file)[0] + '.xlsx'
+        pd.read_parquet(parquet_file).to_excel(excel_file, index=False)
+        print(f"Exported {excel_file}")
 
-def plot_soil_distributions(df):
-    numeric_df = df.select_dtypes(include=[np.number])
-    sns.set_theme(style="whitegrid")
-    cols = numeric_df.columns
-    num_cols = len(cols)
-    
-    if num_cols == 0:
-        print("No numeric columns found for distribution plots.")
-        return
-    
-    fig, axes = plt.subplots(nrows=num_cols, ncols=2, figsize=(12, 4 * num_cols))
-    
-    if num_cols == 1:
-        axes = axes.reshape(1, -1)
-    
-    fig.subplots_adjust(hspace=0.4)
-    
-    for i, col in enumerate(cols):
-        # --- Histogram + KDE (Distribution & Shape) ---
-        sns.histplot(numeric_df[col].dropna(), kde=True, ax=axes[i, 0], color='skyblue')
-        axes[i, 0].set_title(f'Distribution of {col}')
-        axes[i, 0].set_xlabel(col)
-        
-        # --- Boxplot (Outlier Detection) ---
-        sns.boxplot(x=numeric_df[col].dropna(), ax=axes[i, 1], color='lightcoral')
-        axes[i, 1].set_title(f'Outliers in {col}')
-        axes[i, 1].set_xlabel(col)
-
-        # Add missing data annotation
-        missing_count = df[col].isnull().sum()
-        missing_pct = (missing_count / len(df)) * 100
-        axes[i, 0].text(0.95, 0.95, f'Missing: {missing_count} ({missing_pct:.1f}%)', 
-                        transform=axes[i, 0].transAxes, ha='right', va='top', 
-                        bbox=dict(boxstyle='round', facecolor='white', alpha=0.5))
-
-    plt.tight_layout()
-    plt.savefig(os.path.join(output_dir, 'soil_distributions.png'), dpi=150, bbox_inches='tight')
-    print(f"Saved distribution plots to {os.path.join(output_dir, 'soil_distributions.png')}")
-    plt.close()
-
-
-def print_summary_stats(df):
-    """Print summary statistics for the dataset"""
-    print("\n" + "="*60)
-    print("DATASET SUMMARY")
-    print("="*60)
-    print(f"Total rows: {len(df)}")
-    print(f"Total columns: {len(df.columns)}")
-    
-    print("\n--- Missing Data Summary ---")
-    missing = df.isnull().sum()
-    missing_pct = (missing / len(df)) * 100
-    missing_df = pd.DataFrame({'Missing Count': missing, 'Missing %': missing_pct})
-    missing_df = missing_df[missing_df['Missing Count'] > 0].sort_values('Missing %', ascending=False)
-    if len(missing_df) > 0:
-        print(missing_df.to_string())
-    else:
-        print("No missing data found.")
-    
-    df.describe().to_csv(os.path.join(output_dir, 'combined_statistics.csv'))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(parse_stages(sys.argv[1:], STAGES))
\ No newline at end of file
@@ -0,0 +1,123 @@
+import os
+import time
+import argparse
+import pandas as pd
+from ssurgo_core.config import ROOT, OUTPUT_ROOT, MAPPING_EXCEL_FILE
+from ssurgo_core.pipeline import load_script
+from ssurgo_core.profiling import profile_stage, get_records, add_records, write_run_report
+from ssurgo_core.spatial import load_points
+from ssurgo_core.ratings import get_rating_name
+from ssurgo_core.schema import TEXT_RATINGS
+from ssurgo_core.reader import GpkgReader
+from ssurgo_core.dedup import resolve_duplicates
+from ssurgo_core.fill import fill_ssurgo_with_solus
+from ssurgo_core.missing import create_missing_point_fc
+from ssurgo_core import synthetic
+
+''' time the heavy parts of the pipeline on synthetic inputs: no real gpkgs or ArcGIS needed
+    python benchmark.py                                   # 1x, 10x and 100x of the 66k nri points
+    python benchmark.py --scales 1 10 --states 2 --polygons 5000 --vertices 20
+the synthetic state gpkgs are generated once per setting and reused (--regenerate to rebuild them),
+the points are generated per scale. timed: step 02 inventory, step 04 extract_state per state with a
+cold rating cache and again warm, cross-state dedup, step 05 fill and the missing point export, with
+the per state/table breakdown of ssurgo_core.profiling (spatial_join, gpkg_query, read_cached_rating,
+with a cache label) in the run report. the states run one after the other so each is timed alone.'''
+
+N_POINTS_1X = 66_000
+BENCHMARK_DIR = os.path.join(OUTPUT_ROOT, 'benchmark')
+BENCHMARK_STAGES = ['step02_inventory', 'load_points', 'step04_extract_cold', 'step04_extract_warm',
+                    'step04_dedup', 'step05_fill', 'step05_missing_export']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on synthetic SSURGO gpkgs.')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 10, 100], help=f'multiples of {N_POINTS_1X} points')
+    parser.add_argument('--states', type=int, default=4)
+    parser.add_argument('--polygons', type=int, default=50_000, help='MUPOLYGON polygons per state')
+    parser.add_argument('--vertices', type=int, default=40, help='vertices per polygon')
+    parser.add_argument('--regenerate', action='store_true', help='rebuild the synthetic gpkgs')
+    parser.add_argument('--output-dir', default=BENCHMARK_DIR)
+    args = parser.parse_args()
+    started = time.time()
+
+    s02 = load_script(os.path.join(ROOT, '02_get_rating_tables_summary.py'))
+    s04 = load_script(os.path.join(ROOT, '04_extract_rating_tables_from_a_variable_list.py'))
+    variables = [get_rating_name(t) for t in s04.RATING_TABLES]
+    mapping = pd.read_excel(MAPPING_EXCEL_FILE, sheet_name='mapping').dropna(subset=['ssurgo'])
+
+    # synthetic state gpkgs, shared by all scales
+    gpkg_dir = os.path.join(args.output_dir, f'gpkg_{args.states}x{args.polygons}x{args.vertices}')
+    if args.regenerate or not os.path.isdir(gpkg_dir):
+        print(f'generating {args.states} synthetic state gpkgs in {gpkg_dir}')
+        synthetic.make_state_gpkgs(gpkg_dir, args.states, args.polygons, args.vertices,
+                                   [v for v in variables if v not in TEXT_RATINGS], [v for v in variables if v in TEXT_RATINGS])
+    states = sorted(folder.replace('_gpkg', '') for folder in os.listdir(gpkg_dir))
+    state_bounds = {state: (i * synthetic.STATE_SIZE, 0., (i + 1) * synthetic.STATE_SIZE, synthetic.STATE_SIZE)
+                    for i, state in enumerate(states)}
+
+    s02.database_path = gpkg_dir
+    with profile_stage('step02_inventory', rows_in=len(states)) as record, GpkgReader(max_workers=s02.N_THREADS) as reader:
+        record['rows_out'] = len(s02.read_gpkg_inventories([f'{state}_gpkg' for state in states], reader))
+
+    for scale in args.scales:
+        n_points = int(N_POINTS_1X * scale)
+        print(f'\nscale {scale:g}x: {n_points} points')
+        points_fc = synthetic.make_points(os.path.join(args.output_dir, f'points_{scale:g}x.gpkg'), 'nri', state_bounds, n_points)
+        run_scale(s04, points_fc, states, gpkg_dir, mapping, os.path.join(args.output_dir, f'out_{scale:g}x'), scale)
+
+    report_path = write_run_report(os.path.join(args.output_dir, 'reports'), 'benchmark', started,
+                                   states=args.states, polygons=args.polygons, vertices=args.vertices)
+    print_summary(get_records())
+    return report_path
+
+
+def run_scale(s04, points_fc, states, gpkg_dir, mapping, output_dir, scale):
+    with profile_stage('load_points', scale=scale) as record:
+        points_gdf = load_points(points_fc)
+        record['rows_out'] = len(points_gdf)
+
+    # step 04 as it runs: extract_state with the shared reader and the rating cache, once with a cold
+    # cache (full table copies from the gpkg) and once warm (filtered reads from the cache only)
+    s04.STATE_GPKG_DIR = gpkg_dir
+    s04.OUTPUT_DIR = output_dir
+    s04.output_state_dataset_dir = os.path.join(output_dir, 'ssurgo_ratings_by_state')
+    s04.output_rating_cache_dir = os.path.join(output_dir, 'rating_cache')
+    s04._worker_point_sets = {s04.PRIMARY_POINT_SET: points_gdf}
+    state_dfs = []
+    for state in states:
+        if os.path.exists(s04.rating_cache_path(state)):
+            os.remove(s04.rating_cache_path(state))
+        for cache in ['cold', 'warm']:
+            records = get_records(clear=True)  # extract_state clears the records and returns those of its state
+            with profile_stage(f'step04_extract_{cache}', rows_in=len(points_gdf), scale=scale, state=state) as record:
+                n_rows, _, state_records = s04.extract_state(state, s04.RATING_TABLES)
+                record['rows_out'] = sum(n_rows.values())
+            add_records(records + [{**r, 'scale': scale, 'cache': cache} for r in state_records] + get_records(clear=True))
+        state_df = pd.read_parquet(s04.state_parquet_path(state), partitioning=None)
+        state_dfs.append(state_df.assign(state=state))
+    df = pd.concat(state_dfs, ignore_index=True)
+    with profile_stage('step04_dedup', rows_in=len(df), scale=scale) as record:
+        rating_columns = [col for col in df.columns if col not in ('PrimaryKey', 'mukey', 'state')]
+        df, _ = resolve_duplicates(df, points_gdf.set_index('PrimaryKey')['STATE_NAME'], rating_columns)
+        record['rows_out'] = len(df)
+
+    ssurgo_variables = [v for v in mapping.ssurgo if v in df.columns]
+    df_solus = synthetic.make_solus(points_gdf['PrimaryKey'].to_numpy(), mapping.solus.tolist())
+    with profile_stage('step05_fill', rows_in=len(df), scale=scale) as record:
+        df_filled, _, _ = fill_ssurgo_with_solus(df.set_index('PrimaryKey')[ssurgo_variables], df_solus, mapping)
+        record['rows_out'] = len(df_filled)
+
+    with profile_stage('step05_missing_export', rows_in=len(df), scale=scale):
+        create_missing_point_fc(df_filled.reset_index(), points_fc, ssurgo_variables,
+                                os.path.join(output_dir, 'missing_datapoints.gpkg'))
+
+
+def print_summary(records):
+    df = pd.DataFrame([r for r in records if r['stage'] in BENCHMARK_STAGES])
+    summary = df.groupby(['stage', df['scale'].fillna(0)], sort=False).agg(
+        seconds=('seconds', 'sum'), rows_in=('rows_in', 'sum'), rows_out=('rows_out', 'sum'), peak_rss_mb=('peak_rss_mb', 'max'))
+    print('\n' + summary.to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import os
+import argparse
+from ssurgo_core.config import ROOT, OUTPUT_ROOT, DOWNLOAD_DIR, STATE_GPKG_DIR, POINTS_FC, SOLUS_FILE, MAPPING_EXCEL_FILE
+from ssurgo_core.pipeline import run_pipeline, load_script
+
+''' run steps 01-05 as one incremental build instead of editing if False: blocks
+only the steps whose inputs (content), parameters or script changed since their last successful
+run are executed, and steps that don't depend on each other run at the same time, e.g.
+    python run_pipeline.py                  # everything that is stale
+    python run_pipeline.py 05_missing       # 05_missing and whatever it needs
+    python run_pipeline.py --dry-run        # only list what would run
+    python run_pipeline.py 04_extract --force
+step 04 also redoes only the states whose gpkg, points or rating tables changed (state_manifest.json).
+paths come from ssurgo_core/config.py and can be set with SSURGO_* environment variables.'''
+
+PIPELINE_STATE = os.path.join(OUTPUT_ROOT, 'pipeline_state.json')  # fingerprint of the last successful run of each step
+PIPELINE_LOG_DIR = os.path.join(OUTPUT_ROOT, 'pipeline_logs')
+
+
+def get_steps():
+    s02 = load_script(os.path.join(ROOT, '02_get_rating_tables_summary.py'))
+    s03 = load_script(os.path.join(ROOT, '03_compare_ssurgo_variables_at_depth.py'))
+    s04 = load_script(os.path.join(ROOT, '04_extract_rating_tables_from_a_variable_list.py'))
+    s05 = load_script(os.path.join(ROOT, '05_combine_ssurgo_with_solus.py'))
+    state_folders = sorted(os.listdir(DOWNLOAD_DIR)) if os.path.isdir(DOWNLOAD_DIR) else None
+
+    return [
+        {'name': '01_check', 'script': os.path.join(ROOT, '01_check_missing_state_pkgp.py'),
+         'inputs': [], 'outputs': [], 'params': {'state_folders': state_folders}},
+        {'name': '02_inventory', 'script': s02.__file__,
+         'inputs': [STATE_GPKG_DIR],
+         'outputs': [os.path.join(s02.output_directory, s02.output_tablename),
+                     os.path.join(s02.output_directory, s02.output_stats_tablename)]},
+        {'name': '03_compare', 'script': s03.__file__,
+         'inputs': [STATE_GPKG_DIR if s03.SOURCE == 'gpkg' else s03.input_dir, MAPPING_EXCEL_FILE],
+         'outputs': [os.path.join(s03.output_dir, 'compare_depth_stats.csv')]},
+        {'name': '04_extract', 'script': s04.__file__, 'stages': ['extract'],
+         'inputs': [STATE_GPKG_DIR, *s04.POINT_SETS.values(), s04.RATING_AVAILABILITY_CSV],
+         'outputs': [s04.get_output_path(point_set, path) for point_set in s04.POINT_SETS
+                     for path in (s04.output_parquet_path, s04.output_duplicates_csv, s04.output_store_dir)]},
+        {'name': '04_summary', 'script': s04.__file__, 'stages': ['summary'],
+         'inputs': [s04.get_output_path(point_set, s04.output_parquet_path) for point_set in s04.POINT_SETS]
+                   + list(s04.POINT_SETS.values()),
+         'outputs': [s04.get_output_path(point_set, path) for point_set in s04.POINT_SETS
+                     for path in (s04.output_summary_excel, s04.output_missing_primarykeys_fc)]},
+        {'name': '05_fill', 'script': s05.__file__, 'stages': ['fill'],
+         'inputs': [s05.rating_all_states_file, SOLUS_FILE, MAPPING_EXCEL_FILE],
+         'outputs': [s05.output_file_combined, s05.output_file_before_combine, s05.output_file_provenance,
+                     s05.output_excel_file_missing_filling_count, s05.output_store_dir]},
+        {'name': '05_summary', 'script': s05.__file__, 'stages': ['summary'],
+         'inputs': [s05.output_file_combined],
+         'outputs': [os.path.join(s05.output_dir, 'combined_statistics.csv'),
+                     os.path.join(s05.output_dir, 'soil_distributions_summary.json')]},
+        {'name': '05_missing', 'script': s05.__file__, 'stages': ['missing'],
+         'inputs': [s05.output_file_combined, POINTS_FC, MAPPING_EXCEL_FILE],
+         'outputs': [s05.output_missing_gpkg]},
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Incremental run of the ssurgo steps 01-05.')
+    parser.add_argument('steps', nargs='*', help='steps to bring up to date (with their upstream steps), all by default')
+    parser.add_argument('--force', action='store_true', help='rerun all selected steps even if they are up to date')
+    parser.add_argument('--dry-run', action='store_true', help='only print which steps would run')
+    parser.add_argument('--workers', type=int, default=2, help='steps run at the same time')
+    args = parser.parse_args()
+
+    report = run_pipeline(get_steps(), PIPELINE_STATE, PIPELINE_LOG_DIR, targets=args.steps, force=args.force,
+                          dry_run=args.dry_run, max_workers=args.workers)
+    if any(row['status'] in ('failed', 'blocked') for row in report.values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
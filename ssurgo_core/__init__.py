@@ -0,0 +1,22 @@
+"""
+Shared helpers for the numbered pipeline scripts.
+
+config: input/output paths, overridable with SSURGO_* environment variables
+gpkg: read-only access to the state GeoPackages
+reader: shared pool of read-only gpkg connections with concurrent queries and time limits
+spatial: nri points and the point-in-polygon join against MUPOLYGON
+ratings: rating tables -> one wide mukey table, rating cache, step 02 availability
+schema: column types of the ratings tables
+dedup: one row per PrimaryKey for points joined in several states
+fill: filling ssurgo with solus
+missing: export of the points missing each variable
+distributions: summary stats and distribution plots
+store: memory-mapped column store for lookups by PrimaryKey and mukey
+pipeline, profiling: incremental runner for the steps, per stage time/memory/row records
+synthetic: synthetic gpkgs and points for benchmark.py
+
+Importing the package is cheap: geopandas, shapely and matplotlib are only imported
+on first use (see lazy.py), so data-only steps start fast.
+"""
+
+PRIMARY_KEY_FIELD = "PrimaryKey"
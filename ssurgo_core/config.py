@@ -0,0 +1,34 @@
+import os
+
+"""
+Machine specific paths, overridable with environment variables so the same scripts run on the
+Windows workstation (defaults below) and on Linux workers, e.g.
+    SSURGO_GPKG_DIR=/mnt/b/.../02_gpkg_by_state_database python run_pipeline.py
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def env_path(name, default):
+    return os.environ.get(name) or default
+
+
+def env_point_sets(name):
+    # "design2=D:\pts.gdb\design2;design3=/data/pts.gpkg/design3" -> {'design2': ..., 'design3': ...}
+    return dict(item.split('=', 1) for item in os.environ.get(name, '').split(';') if item.strip())
+
+
+# inputs
+DOWNLOAD_DIR = env_path('SSURGO_DOWNLOAD_DIR', r"D:\work\data\ssurgo_download\DATABSE20251213")  # raw bulk download (step 01)
+EXCEL_EXPORT_DIR = env_path('SSURGO_EXCEL_DIR', r"D:\work\data\ssurgo_download\DATABSE20251213_excel")  # rating workbooks (step 03)
+STATE_GPKG_DIR = env_path('SSURGO_GPKG_DIR', r"B:\work_subset\projects\data\ssurgo_portal\02_gpkg_by_state_database")
+POINTS_FC = env_path('SSURGO_POINTS_FC', r"B:\work_subset\projects\src\ssurgo\inputs\nri66k_points.gdb\nri66k_state_prj_ssurgo")
+EXTRA_POINT_SETS = env_point_sets('SSURGO_POINT_SETS')  # other sample designs extracted with the nri points (step 04)
+SOLUS_FILE = env_path('SSURGO_SOLUS_FILE', r"B:\work_subset\projects\src\solus\outputs\v2\all_66k_values.xlsx")
+MAPPING_EXCEL_FILE = os.path.join(ROOT, 'soil_variables_mapping_between_ssurgo_solus.xlsx')
+
+# outputs, one folder per step
+OUTPUT_ROOT = env_path('SSURGO_OUTPUT_DIR', os.path.join(ROOT, 'outputs', 'v2'))
+STEP02_OUTPUT_DIR = os.path.join(OUTPUT_ROOT, '02_rating_tables_list_in_all_gpkg')
+STEP04_OUTPUT_DIR = os.path.join(OUTPUT_ROOT, '04_rating_tables_all_variables')
+STEP05_OUTPUT_DIR = os.path.join(OUTPUT_ROOT, '05_combine_ssurgo_solus')
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+from . import PRIMARY_KEY_FIELD
+
+"""
+One row per PrimaryKey in the national ratings table.
+
+The state gpkgs overlap at the borders, so a point near a border is joined in every gpkg that
+covers it and gets one row per state. resolve_duplicates keeps one of them:
+1. the row of the point's own state (STATE_NAME of the points), if it was joined there
+2. otherwise, or between several rows of that state, the row with the fewest null ratings
+3. then the first state in merge order (alphabetical)
+"""
+
+RESOLVE_OWN_STATE = 'own_state'
+RESOLVE_FEWEST_NULLS = 'fewest_nulls'
+RESOLVE_FIRST_STATE = 'first_state'
+
+
+def normalize_state_name(names):
+    # gpkg folders use underscores (New_Mexico_gpkg), the points use spaces (New Mexico)
+    return pd.Series(names).astype('string').str.replace('_', ' ').str.strip().str.lower()
+
+
+def find_duplicate_keys(primary_keys):
+    """The PrimaryKeys that occur more than once, as a hash index."""
+    primary_keys = pd.Series(primary_keys)
+    return pd.Index(primary_keys[primary_keys.duplicated()].unique())
+
+
+def resolve_duplicates(df, point_states, rating_columns):
+    """Keep one row per PrimaryKey of df (rows of all states, with a state column).
+
+    point_states maps PrimaryKey to the point's STATE_NAME, None for points without one (then
+    only rules 2 and 3 apply). The rule above is applied in one
+    groupby over a per-row score. Returns the kept rows and a conflict report with one row per
+    PrimaryKey that had more than one row: its states, the kept state, the rule that decided and
+    whether the rows disagree on any rating.
+    """
+    df = df.reset_index(drop=True)
+    keys = df[PRIMARY_KEY_FIELD].to_numpy()
+    point_state = df[PRIMARY_KEY_FIELD].map(point_states) if point_states is not None \
+        else pd.Series(None, index=df.index, dtype=object)
+    own_state = (normalize_state_name(df['state'].to_numpy())
+                 == normalize_state_name(point_state.to_numpy())).fillna(False).to_numpy(dtype=bool)
+    n_nulls = df[rating_columns].isna().sum(axis=1).to_numpy()
+
+    # lower is better, a row outside the point's own state ranks after any row inside it
+    score = pd.Series(np.where(own_state, 0, len(rating_columns) + 1) + n_nulls, index=df.index)
+    grouped = score.groupby(keys, sort=False)
+    kept_rows = grouped.idxmin().to_numpy()  # first row on ties, rows are in merge (state) order
+    kept = df.loc[kept_rows].reset_index(drop=True)
+
+    # conflict report, for the duplicated keys only
+    n_rows = grouped.size().to_numpy()
+    duplicated = n_rows > 1
+    n_best = (score == grouped.transform('min')).groupby(keys, sort=False).sum().to_numpy()
+    rule = np.where(own_state[kept_rows], RESOLVE_OWN_STATE,
+                    np.where(n_best > 1, RESOLVE_FIRST_STATE, RESOLVE_FEWEST_NULLS))
+    duplicate_rows = df[df[PRIMARY_KEY_FIELD].isin(kept[PRIMARY_KEY_FIELD][duplicated])]
+    duplicate_groups = duplicate_rows.groupby(PRIMARY_KEY_FIELD, sort=False, observed=True)
+    values_differ = duplicate_groups[rating_columns].nunique(dropna=False).gt(1).any(axis=1)
+    report = pd.DataFrame({
+        PRIMARY_KEY_FIELD: kept[PRIMARY_KEY_FIELD].to_numpy(),
+        'point_state': point_state.to_numpy()[kept_rows],
+        'kept_state': kept['state'].astype(str).to_numpy(),
+        'rule': rule,
+        'n_rows': n_rows,
+        'nulls_kept': n_nulls[kept_rows],
+    })[duplicated]
+    report['states'] = report[PRIMARY_KEY_FIELD].map(duplicate_groups['state'].agg(lambda s: ','.join(s.astype(str))))
+    report['values_differ'] = report[PRIMARY_KEY_FIELD].map(values_differ).to_numpy(dtype=bool)
+    return kept, report.reset_index(drop=True)
@@ -0,0 +1,136 @@
+import os
+import json
+import warnings
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+"""
+Summary statistics and distributions of the numeric columns of a table (used by step 05 and tbd_06).
+Histograms on fixed bins, boxplot statistics and missing counts are computed for all columns in one
+vectorized pass and saved as a small json file; the plots are rendered from that summary only,
+one png per variable, in parallel worker processes with the non-interactive Agg backend.
+"""
+
+N_BINS = 50
+WHISKER_IQR = 1.5  # boxplot whiskers, like seaborn/matplotlib
+
+
+def print_summary_stats(df, output_dir):
+    """Print summary statistics for the dataset, describe() goes to combined_statistics.csv"""
+    print("\n" + "="*60)
+    print("DATASET SUMMARY")
+    print("="*60)
+    print(f"Total rows: {len(df)}")
+    print(f"Total columns: {len(df.columns)}")
+
+    print("\n--- Missing Data Summary ---")
+    missing = df.isnull().sum()
+    missing_pct = (missing / len(df)) * 100
+    missing_df = pd.DataFrame({'Missing Count': missing, 'Missing %': missing_pct})
+    missing_df = missing_df[missing_df['Missing Count'] > 0].sort_values('Missing %', ascending=False)
+    if len(missing_df) > 0:
+        print(missing_df.to_string())
+    else:
+        print("No missing data found.")
+
+    df.describe().to_csv(os.path.join(output_dir, 'combined_statistics.csv'))
+
+
+def plot_soil_distributions(df, output_dir, n_workers=None):
+    summaries = summarize_distributions(df)
+    if len(summaries) == 0:
+        print("No numeric columns found for distribution plots.")
+        return
+    summary_file = os.path.join(output_dir, 'soil_distributions_summary.json')
+    write_summaries(summaries, summary_file)
+    plot_dir = os.path.join(output_dir, 'soil_distributions')
+    plot_distributions(summaries, plot_dir, n_workers)
+    print(f"Saved distribution summary to {summary_file} and plots to {plot_dir}")
+
+
+def summarize_distributions(df, bins=N_BINS):
+    """Histogram, boxplot statistics and missing count of every numeric column, as {column: summary}."""
+    numeric_df = df.select_dtypes(include=[np.number])
+    columns = numeric_df.columns
+    if len(columns) == 0:
+        return {}
+    values = numeric_df.to_numpy(dtype=np.float64)
+    valid = ~np.isnan(values)
+    n_valid = valid.sum(axis=0)
+
+    with warnings.catch_warnings(), np.errstate(invalid='ignore'):
+        warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN columns just get NaN statistics
+        vmin, q1, median, q3, vmax = np.nanquantile(values, [0., .25, .5, .75, 1.], axis=0)
+        iqr = q3 - q1
+        whislo = np.nanmin(np.where(values >= q1 - WHISKER_IQR * iqr, values, np.nan), axis=0)
+        whishi = np.nanmax(np.where(values <= q3 + WHISKER_IQR * iqr, values, np.nan), axis=0)
+        n_outliers = (valid & ((values < whislo) | (values > whishi))).sum(axis=0)
+        mean = np.nansum(values, axis=0) / np.maximum(n_valid, 1)
+
+        # all histograms in one bincount: bin index of every cell, offset by its column
+        width = np.where(vmax > vmin, (vmax - vmin) / bins, 1.)
+        bin_index = np.clip(np.floor((values - vmin) / width), 0, bins - 1)
+        flat_index = (bin_index + np.arange(len(columns)) * bins)[valid].astype(np.int64)
+    counts = np.bincount(flat_index, minlength=len(columns) * bins).reshape(len(columns), bins)
+
+    summaries = {}
+    for i, col in enumerate(columns):
+        summaries[str(col)] = {
+            'n': int(n_valid[i]),
+            'missing': int(len(df) - n_valid[i]),
+            'rows': int(len(df)),
+            'mean': float(mean[i]),
+            'min': float(vmin[i]), 'q1': float(q1[i]), 'median': float(median[i]), 'q3': float(q3[i]), 'max': float(vmax[i]),
+            'whislo': float(whislo[i]), 'whishi': float(whishi[i]), 'n_outliers': int(n_outliers[i]),
+            'bin_edges': (vmin[i] + width[i] * np.arange(bins + 1)).tolist(),
+            'counts': counts[i].tolist(),
+        }
+    return summaries
+
+
+def write_summaries(summaries, summary_file):
+    os.makedirs(os.path.dirname(summary_file), exist_ok=True)
+    with open(summary_file, 'w') as f:
+        json.dump(summaries, f)
+
+
+def read_summaries(summary_file):
+    with open(summary_file) as f:
+        return json.load(f)
+
+
+def plot_distributions(summaries, plot_dir, n_workers=None):
+    os.makedirs(plot_dir, exist_ok=True)
+    names = list(summaries)
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        list(pool.map(plot_distribution, names, [summaries[name] for name in names], [plot_dir] * len(names)))
+
+
+def plot_distribution(name, summary, plot_dir):
+    """Histogram and boxplot of one variable, drawn from its summary."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, (ax_hist, ax_box) = plt.subplots(nrows=1, ncols=2, figsize=(12, 4))
+    if summary['n'] > 0:
+        ax_hist.stairs(summary['counts'], summary['bin_edges'], fill=True, color='skyblue', edgecolor='steelblue')
+        ax_box.bxp([{'med': summary['median'], 'q1': summary['q1'], 'q3': summary['q3'],
+                     'whislo': summary['whislo'], 'whishi': summary['whishi'], 'fliers': []}],
+                   orientation='horizontal', showfliers=False, patch_artist=True,
+                   boxprops=dict(facecolor='lightcoral'))
+        ax_box.set_yticks([])
+    ax_hist.set_title(f'Distribution of {name}')
+    ax_hist.set_xlabel(name)
+    ax_box.set_title(f"Outliers in {name} ({summary['n_outliers']} beyond whiskers)")
+    ax_box.set_xlabel(name)
+
+    missing_pct = summary['missing'] / summary['rows'] * 100 if summary['rows'] else 0.
+    ax_hist.text(0.95, 0.95, f"Missing: {summary['missing']} ({missing_pct:.1f}%)",
+                 transform=ax_hist.transAxes, ha='right', va='top',
+                 bbox=dict(boxstyle='round', facecolor='white', alpha=0.5))
+
+    fig.tight_layout()
+    fig.savefig(os.path.join(plot_dir, f'{name}.png'), dpi=150, bbox_inches='tight')
+    plt.close(fig)
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+from .schema import RATING_DTYPE
+
+# provenance flags per cell of the combined table
+PROVENANCE_SSURGO = 1   # value from ssurgo
+PROVENANCE_SOLUS = 2    # missing in ssurgo, filled from solus
+PROVENANCE_MISSING = 4  # missing in both
+
+
+def fill_ssurgo_with_solus(df_ssurgo, df_solus, df_variable_mapping):
+    """Fill missing ssurgo values with solus values times the mapping multiplier, all mapped columns at once.
+
+    Both frames are indexed by PrimaryKey (see normalize_primary_keys); solus is aligned to the ssurgo rows once and the fill,
+    the before/after missing counts and the per-cell provenance flags are computed on numpy blocks.
+    Returns the filled frame, the missing counts and the provenance flags (same shape as df_ssurgo).
+    The filled ratings stay float32 like the ssurgo ratings (see ssurgo_core.schema).
+    """
+    mapping = df_variable_mapping[df_variable_mapping.ssurgo.isin(df_ssurgo.columns)
+                                  & df_variable_mapping.solus.isin(df_solus.columns)]
+    ssurgo_cols = mapping.ssurgo.tolist()
+    print(f"filling {len(ssurgo_cols)} ssurgo variables from solus: {', '.join(ssurgo_cols)}")
+
+    ssurgo_values = df_ssurgo[ssurgo_cols].to_numpy(dtype=RATING_DTYPE)
+    df_solus = df_solus[mapping.solus.tolist()].set_axis(normalize_primary_keys(df_solus.index))
+    ssurgo_keys = normalize_primary_keys(df_ssurgo.index)
+    if len(ssurgo_keys) and not ssurgo_keys.isin(df_solus.index).any():
+        raise ValueError(f"no ssurgo PrimaryKey found in solus (ssurgo keys like {ssurgo_keys[:3].tolist()}, "
+                         f"solus keys like {df_solus.index[:3].tolist()}), nothing would be filled")
+    solus_values = df_solus.reindex(ssurgo_keys).to_numpy(dtype=np.float64)
+    solus_values = (solus_values * mapping.multiplier.to_numpy(dtype=np.float64)).astype(RATING_DTYPE)
+
+    missing_before = np.isnan(ssurgo_values)
+    filled_values = np.where(missing_before, solus_values, ssurgo_values)
+    missing_after = np.isnan(filled_values)
+
+    df_filled = df_ssurgo.copy()
+    df_filled[ssurgo_cols] = filled_values
+
+    df_missing_filling_count = pd.DataFrame([missing_before.sum(axis=0), missing_after.sum(axis=0)],
+                                            index=['missing_before', 'missing_after'], columns=ssurgo_cols)
+    df_missing_filling_count = df_missing_filling_count.reindex(columns=df_ssurgo.columns)
+
+    provenance = np.full(ssurgo_values.shape, PROVENANCE_SSURGO, dtype=np.uint8)
+    provenance[missing_before] = PROVENANCE_SOLUS
+    provenance[missing_after] = PROVENANCE_MISSING
+    df_provenance = pd.DataFrame(provenance, index=df_ssurgo.index, columns=ssurgo_cols)
+
+    return df_filled, df_missing_filling_count, df_provenance
+
+
+def normalize_primary_keys(index):
+    """PrimaryKeys as int64 when they are all whole numbers, else as text.
+
+    The points keep text keys ('000123') while read_excel turns the solus keys into integers (123),
+    so both sides are brought to one key type before they are aligned.
+    """
+    if pd.api.types.is_integer_dtype(index):
+        return index.astype(np.int64)
+    numeric = pd.to_numeric(index, errors='coerce')
+    if len(index) and numeric.notna().all() and (numeric == np.floor(numeric)).all():
+        return pd.Index(numeric.astype(np.int64), name=index.name)
+    return index.astype(str)
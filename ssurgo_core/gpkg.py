@@ -0,0 +1,102 @@
+import os
+import hashlib
+import sqlite3
+from pathlib import Path
+from contextlib import closing
+
+"""Read-only access to the state gpkgs: <gpkg_dir>/<state>_gpkg/<state>.gpkg"""
+
+SOIL_POLY = "MUPOLYGON"
+
+
+def connect_gpkg(gpkg_path, immutable=False, **kwargs):
+    """Open a gpkg read-only so the SSURGO database can never be modified by the pipeline.
+
+    immutable=True also tells sqlite the file doesn't change while it is open, so it takes no
+    file locks and skips change detection, which saves round trips on a network share.
+    """
+    return sqlite3.connect(f"{gpkg_uri(gpkg_path, immutable)}", uri=True, **kwargs)
+
+
+def gpkg_uri(gpkg_path, immutable=False):
+    return f"{Path(gpkg_path).absolute().as_uri()}?mode=ro{'&immutable=1' if immutable else ''}"
+
+
+def state_gpkg_path(state_name, gpkg_dir):
+    return os.path.join(gpkg_dir, f"{state_name}_gpkg", f"{state_name}.gpkg")
+
+
+def get_state_gpkg_path(state_name, gpkg_dir):
+    gpkg_path = state_gpkg_path(state_name, gpkg_dir)
+    if not os.path.exists(gpkg_path):
+        raise FileNotFoundError(f"GPKG not found for {state_name}")
+
+    with closing(connect_gpkg(gpkg_path)) as conn:
+        found = conn.execute(
+            "SELECT 1 FROM gpkg_contents WHERE lower(table_name) = lower(?)", (SOIL_POLY,)).fetchone()
+    if found is None:
+        raise FileNotFoundError(f"'{SOIL_POLY}' not found in GPKG for {state_name}")
+
+    return gpkg_path, SOIL_POLY
+
+
+def get_state_gpkg_size(state_name, gpkg_dir):
+    gpkg_path = state_gpkg_path(state_name, gpkg_dir)
+    return os.path.getsize(gpkg_path) if os.path.exists(gpkg_path) else 0
+
+
+def get_states_from_gpkglist(gpkg_dir):
+    return sorted(foldername.replace('_gpkg', '') for foldername in os.listdir(gpkg_dir))
+
+
+def get_geometry_column(conn, table_name):
+    row = conn.execute(
+        "SELECT column_name FROM gpkg_geometry_columns WHERE lower(table_name) = lower(?)",
+        (table_name,)).fetchone()
+    if row is None:
+        raise ValueError(f"'{table_name}' is not a feature table in this gpkg")
+    return row[0]
+
+
+def get_layer_crs(conn, table_name):
+    """CRS of a feature table as 'EPSG:<code>' or its WKT, None if the gpkg leaves it undefined (srs_id 0 or -1)."""
+    row = conn.execute(
+        "SELECT s.srs_id, s.organization, s.organization_coordsys_id, s.definition FROM gpkg_geometry_columns g "
+        "JOIN gpkg_spatial_ref_sys s ON s.srs_id = g.srs_id WHERE lower(g.table_name) = lower(?)",
+        (table_name,)).fetchone()
+    if row is None or row[0] in (0, -1):
+        return None
+    srs_id, organization, code, definition = row
+    if organization and organization.upper() == 'EPSG' and code:
+        return f"EPSG:{code}"
+    return definition
+
+
+def get_rtree_name(conn, table_name, geom_col):
+    """Name of the gpkg rtree spatial index of a feature table, None if it has none."""
+    rtree_name = f"rtree_{table_name}_{geom_col}"
+    found = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND lower(name) = lower(?)", (rtree_name,)).fetchone()
+    return found[0] if found else None
+
+
+def gpkg_blob_to_wkb(blob):
+    """Strip the GeoPackage binary header (magic, version, flags, srs_id, envelope) from a geometry blob."""
+    flags = blob[3]
+    envelope_size = (0, 32, 48, 48, 64)[(flags >> 1) & 0b111]
+    return bytes(blob[8 + envelope_size:])
+
+
+def get_gpkg_fingerprint(gpkg_path, sample_bytes=1 << 20):
+    """Size, mtime and a hash of the first and last MB of the gpkg.
+
+    The sqlite header in the first page carries a change counter that is bumped on every write,
+    so this catches edits without hashing a multi-GB file.
+    """
+    stat = os.stat(gpkg_path)
+    digest = hashlib.sha1()
+    with open(gpkg_path, 'rb') as f:
+        digest.update(f.read(sample_bytes))
+        f.seek(max(0, stat.st_size - sample_bytes))
+        digest.update(f.read(sample_bytes))
+    return f'{stat.st_size}-{stat.st_mtime_ns}-{digest.hexdigest()}'
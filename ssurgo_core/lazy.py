@@ -0,0 +1,34 @@
+import importlib
+
+"""
+Heavy backends, imported on first attribute access instead of at script start.
+    from ssurgo_core.lazy import gpd
+    gpd.read_file(...)  # geopandas is imported here
+"""
+
+
+class LazyModule:
+    def __init__(self, name, on_import=None):
+        self._name = name
+        self._on_import = on_import  # called once with the module, e.g. to set environment options
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            module = importlib.import_module(self._name)
+            if self._on_import is not None:
+                self._on_import(module)
+            self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+gpd = LazyModule('geopandas')
+pyogrio = LazyModule('pyogrio')
+shapely = LazyModule('shapely')
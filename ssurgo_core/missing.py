@@ -0,0 +1,75 @@
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from contextlib import closing
+from .spatial import load_points
+from .profiling import profile_stage
+
+
+def create_missing_point_fc(df, point_fc, ssurgo_variables, gpkg_path):
+    """Export the points missing each ssurgo variable to gpkg_path.
+
+    The null masks of all variables are computed in one step and packed into a bitmask
+    (bit i set = ssurgo_variables[i] missing). The points are written once, as a single
+    'missing_datapoints' layer with a missing_bits column, and every '<variable>_missing'
+    layer is a view on it registered in the gpkg in one transaction.
+    """
+    write_missing_point_fc(get_missing_bits(df, ssurgo_variables), point_fc, ssurgo_variables, gpkg_path)
+
+
+def create_missing_point_fc_from_parquet(parquet_path, point_fc, ssurgo_variables, gpkg_path, batch_size):
+    """create_missing_point_fc for a parquet table, read batch_size rows at a time; only the bitmask is kept."""
+    parquet_file = pq.ParquetFile(parquet_path)
+    batches = parquet_file.iter_batches(batch_size=batch_size, columns=['PrimaryKey', *ssurgo_variables])
+    missing_bits = pd.concat([get_missing_bits(batch.to_pandas(), ssurgo_variables) for batch in batches])
+    write_missing_point_fc(missing_bits, point_fc, ssurgo_variables, gpkg_path)
+
+
+def get_missing_bits(df, ssurgo_variables):
+    # one row per point, step 04 resolves the points joined in more than one state
+    if len(ssurgo_variables) > 63:
+        raise ValueError(f"missing_bits holds at most 63 variables, got {len(ssurgo_variables)}")
+    missing = df[['PrimaryKey', *ssurgo_variables]].set_index('PrimaryKey').isna()
+    bit_values = np.left_shift(np.int64(1), np.arange(len(ssurgo_variables), dtype=np.int64))
+    return pd.Series(missing.to_numpy() @ bit_values, index=missing.index)
+
+
+def write_missing_point_fc(missing_bits, point_fc, ssurgo_variables, gpkg_path):
+    # missing_bits: PrimaryKey -> bitmask of the missing variables
+    with profile_stage('create_missing_point_fc', rows_in=len(missing_bits)) as record:
+        gdf = load_points(point_fc)
+        missing_gdf = gdf.assign(missing_bits=gdf['PrimaryKey'].map(missing_bits).fillna(0).astype(np.int64))
+        missing_gdf = missing_gdf[missing_gdf['missing_bits'] > 0]
+
+        if os.path.exists(gpkg_path):
+            os.remove(gpkg_path)
+        missing_gdf.to_file(gpkg_path, layer='missing_datapoints', driver='GPKG')
+        register_missing_views(gpkg_path, 'missing_datapoints', ssurgo_variables)
+        record['rows_out'] = len(missing_gdf)
+
+    bits = missing_bits.to_numpy()
+    for i, var in enumerate(ssurgo_variables):
+        print(f"Exported missing points for {var}: {int(((bits >> i) & 1).sum())}")
+
+
+def register_missing_views(gpkg_path, base_layer, ssurgo_variables):
+    # views on the base layer, registered in gpkg_contents/gpkg_geometry_columns so GIS reads them as layers
+    with closing(sqlite3.connect(gpkg_path)) as conn, conn:
+        contents = conn.execute(
+            "SELECT srs_id, min_x, min_y, max_x, max_y FROM gpkg_contents WHERE table_name = ?", (base_layer,)).fetchone()
+        geometry = conn.execute(
+            "SELECT column_name, geometry_type_name, srs_id, z, m FROM gpkg_geometry_columns WHERE table_name = ?",
+            (base_layer,)).fetchone()
+        conn.execute("CREATE TABLE missing_variables (bit INTEGER PRIMARY KEY, variable TEXT)")
+        conn.executemany("INSERT INTO missing_variables VALUES (?, ?)", enumerate(ssurgo_variables))
+        conn.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier) "
+                     "VALUES ('missing_variables', 'attributes', 'missing_variables')")
+
+        for i, var in enumerate(ssurgo_variables):
+            view = f"{var}_missing"
+            conn.execute(f'CREATE VIEW "{view}" AS SELECT * FROM "{base_layer}" WHERE (missing_bits >> {i}) & 1')
+            conn.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id, min_x, min_y, max_x, max_y) "
+                         "VALUES (?, 'features', ?, ?, ?, ?, ?, ?)", (view, view, *contents))
+            conn.execute("INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, ?, ?, ?)", (view, *geometry))
@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import time
+import glob
+import hashlib
+import subprocess
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from .gpkg import get_gpkg_fingerprint
+
+"""
+Incremental runner for the numbered scripts (see run_pipeline.py for the steps).
+
+A step is a dict
+    {'name': '04_extract', 'script': <path>, 'stages': ['extract'], 'inputs': [paths], 'outputs': [paths], 'params': {}}
+and runs as `python <script> <stages>` in its own process, with its output in <log_dir>/<name>.log.
+A step depends on the steps that write one of its inputs. It is skipped when all its outputs exist
+and its fingerprint (script, stages, params, the content of every input and of the ssurgo_core
+modules the scripts run on) is the one recorded after its last successful run. Steps whose
+dependencies are finished run concurrently.
+"""
+
+FULL_HASH_BYTES = 64 << 20  # files up to this size are hashed completely, bigger ones (gpkgs) are sampled
+
+
+def run_pipeline(steps, state_file, log_dir, targets=None, force=False, dry_run=False, max_workers=2):
+    """Run the stale steps (targets and their upstream steps, or all), returns {step: report}."""
+    dependencies = get_dependencies(steps)
+    if targets:
+        steps = [step for step in steps if step['name'] in get_upstream(targets, dependencies)]
+    pending = {step['name']: step for step in steps}
+    selected = set(pending)
+    state = load_json(state_file)
+    report = {}
+    os.makedirs(log_dir, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        running = {}
+        while pending or running:
+            for name, step in list(pending.items()):
+                upstream = [report.get(dep, {}).get('status') for dep in dependencies[name] if dep in selected]
+                if any(status in ('failed', 'blocked') for status in upstream):
+                    report[name] = {'status': 'blocked'}
+                    del pending[name]
+                    print(f'{name}: blocked by a failed upstream step')
+                elif all(status in ('skipped', 'done', 'stale') for status in upstream):
+                    del pending[name]
+                    fingerprint = step_fingerprint(step)
+                    if not force and 'stale' not in upstream and is_up_to_date(step, state.get(name), fingerprint):
+                        report[name] = {'status': 'skipped', 'output_bytes': get_output_size(step)}
+                        print(f'{name}: up to date')
+                    elif dry_run:
+                        report[name] = {'status': 'stale'}
+                        print(f'{name}: would run')
+                    else:
+                        print(f'{name}: running, log in {os.path.join(log_dir, name + ".log")}')
+                        running[pool.submit(run_step, step, log_dir)] = name
+                        report[name] = {'fingerprint': fingerprint}
+            if not running:
+                if pending:
+                    raise ValueError(f"circular dependencies between {', '.join(pending)}")
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                step = next(s for s in steps if s['name'] == name)
+                returncode, seconds = future.result()
+                fingerprint = report[name].pop('fingerprint')
+                status = 'done' if returncode == 0 else 'failed'
+                report[name] = {'status': status, 'minutes': round(seconds / 60., 2), 'output_bytes': get_output_size(step)}
+                print(f'{name}: {status} in {seconds / 60.:.2f} minutes')
+                if status == 'done':
+                    state[name] = {'fingerprint': fingerprint, 'finished': time.strftime('%Y-%m-%d %H:%M:%S')}
+                    write_json(state, state_file)
+
+    print_report(report)
+    return report
+
+
+def run_step(step, log_dir):
+    start = time.time()
+    with open(os.path.join(log_dir, f"{step['name']}.log"), 'w') as log:
+        result = subprocess.run([sys.executable, '-u', step['script'], *step.get('stages', [])],
+                                cwd=os.path.dirname(os.path.abspath(step['script'])), stdout=log, stderr=subprocess.STDOUT)
+    return result.returncode, time.time() - start
+
+
+def is_up_to_date(step, last_run, fingerprint):
+    return (last_run is not None and last_run.get('fingerprint') == fingerprint
+            and all(os.path.exists(path) for path in step['outputs']))
+
+
+def step_fingerprint(step):
+    inputs = {path: fingerprint_path(path) for path in [step['script'], *step['inputs']]}
+    return hash_params(inputs, step.get('stages', []), step.get('params', {}), core_fingerprint())
+
+
+def core_fingerprint():
+    """Content hash of the ssurgo_core modules (not their mtimes, __pycache__ and checkouts touch those)."""
+    digest = hashlib.sha1()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def fingerprint_path(path):
+    """Fingerprint of a file, a directory or a layer in one (<gdb or gpkg>/<layer>); None if it doesn't exist.
+
+    Files are hashed by content (sampled above FULL_HASH_BYTES, see get_gpkg_fingerprint).
+    Directories such as the state gpkg tree or a .gdb use the name, size and mtime of every file
+    in them, so a re-export is noticed without reading GBs over the network.
+    """
+    if not os.path.exists(path):
+        parent = os.path.dirname(path)
+        is_layer = os.path.isfile(parent) or (parent.lower().endswith('.gdb') and os.path.isdir(parent))
+        return fingerprint_path(parent) if is_layer else None
+    if os.path.isdir(path):
+        digest = hashlib.sha1()
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                stat = os.stat(os.path.join(dirpath, filename))
+                digest.update(f'{os.path.relpath(os.path.join(dirpath, filename), path)}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+        return digest.hexdigest()
+    if os.path.getsize(path) > FULL_HASH_BYTES:
+        return get_gpkg_fingerprint(path)
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_params(*values):
+    return hashlib.sha1(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_dependencies(steps):
+    writers = {os.path.abspath(path): step['name'] for step in steps for path in step['outputs']}
+    return {step['name']: sorted({writers[os.path.abspath(path)] for path in step['inputs']
+                                  if os.path.abspath(path) in writers} - {step['name']})
+            for step in steps}
+
+
+def get_upstream(targets, dependencies):
+    selected, todo = set(), list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in dependencies:
+            raise ValueError(f"unknown step '{name}', steps are {', '.join(dependencies)}")
+        if name not in selected:
+            selected.add(name)
+            todo += dependencies[name]
+    return selected
+
+
+def get_output_size(step):
+    size = 0
+    for path in step['outputs']:
+        if os.path.isdir(path):
+            size += sum(os.path.getsize(os.path.join(dirpath, f)) for dirpath, _, files in os.walk(path) for f in files)
+        elif os.path.exists(path):
+            size += os.path.getsize(path)
+    return size
+
+
+def print_report(report):
+    print(f"\n{'step':<16}{'status':<10}{'minutes':>10}{'output MB':>12}")
+    for name, row in report.items():
+        minutes = f"{row['minutes']:.2f}" if 'minutes' in row else '-'
+        size = f"{row['output_bytes'] / 1e6:.1f}" if 'output_bytes' in row else '-'
+        print(f"{name:<16}{row['status']:<10}{minutes:>10}{size:>12}")
+
+
+def parse_stages(args, stages):
+    """The stages named on the command line of a step, all of them when none; exits with an error on an unknown name."""
+    unknown = [arg for arg in args if arg not in stages]
+    if unknown:
+        raise SystemExit(f"unknown stage {', '.join(unknown)}, the stages are {', '.join(stages)}")
+    return list(args) or list(stages)
+
+
+def load_script(script_path):
+    """Import a numbered script (its file name is not a valid module name) to read its settings."""
+    name = 'step_' + os.path.splitext(os.path.basename(script_path))[0]
+    spec = importlib.util.spec_from_file_location(name, script_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_json(obj, path):
+    # write to a temp file first so an interrupted run never leaves a half written file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+"""
+Per-stage timing, memory and row counts.
+
+    with profile_stage('read_ratings', state=state, rows_in=len(primary_keys)) as record:
+        df = ...
+        record['rows_out'] = len(df)
+
+Every stage adds one record (stage, labels, seconds, rows_in, rows_out, peak RSS) to this process's
+records; labels of enclosing stages are inherited, so a spatial join run inside
+profile_stage('extract_state', state=...) carries the state too. Worker processes send their
+records back to the parent (see get_records/add_records) and the parent writes one json run report
+per run, see write_run_report and load_run_reports to compare runs.
+"""
+
+_records = []
+_context = threading.local()
+
+
+@contextmanager
+def profile_stage(stage, rows_in=None, **labels):
+    labels = {**getattr(_context, 'labels', {}), **labels}
+    record = {'stage': stage, **labels, 'rows_in': rows_in, 'rows_out': None}
+    previous_labels = getattr(_context, 'labels', {})
+    _context.labels = labels
+    peak_before = get_peak_rss_mb()
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record['error'] = repr(e)
+        raise
+    finally:
+        _context.labels = previous_labels
+        record['seconds'] = round(time.perf_counter() - start, 4)
+        peak_after = get_peak_rss_mb()
+        record['peak_rss_mb'] = peak_after
+        # the peak is per process, so a stage only shows an increase if it set a new high-water mark
+        record['peak_rss_increase_mb'] = None if peak_after is None else round(peak_after - peak_before, 1)
+        _records.append(record)
+
+
+def get_peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return round(psutil.Process().memory_info().peak_wset / 2**20, 1)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KB on linux, bytes on macOS
+    return round(peak / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+
+def get_records(clear=False):
+    records = list(_records)
+    if clear:
+        _records.clear()
+    return records
+
+
+def add_records(records):
+    _records.extend(records)
+
+
+def write_run_report(report_dir, step, started, **run_info):
+    """Write the records of this run to <report_dir>/<step>_<start time>_<pid>.json, returns the path."""
+    os.makedirs(report_dir, exist_ok=True)
+    report_path = os.path.join(report_dir, f"{step}_{time.strftime('%Y%m%d_%H%M%S', time.localtime(started))}_{os.getpid()}.json")
+    report = {'step': step, 'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started)),
+              'minutes': round((time.time() - started) / 60., 2), **run_info, 'records': get_records()}
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=1, default=str)
+    print(f"run report: {report_path}")
+    return report_path
+
+
+def load_run_reports(report_dir, step=None):
+    """All records of all run reports in report_dir as one DataFrame, with a run column to compare runs."""
+    import pandas as pd
+    frames = []
+    for filename in sorted(os.listdir(report_dir)):
+        if not filename.endswith('.json') or (step and not filename.startswith(f'{step}_')):
+            continue
+        with open(os.path.join(report_dir, filename)) as f:
+            report = json.load(f)
+        frames.append(pd.DataFrame(report['records']).assign(run=os.path.splitext(filename)[0]))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
@@ -0,0 +1,157 @@
+import os
+import json
+import sqlite3
+import numpy as np
+import pandas as pd
+from contextlib import closing, ExitStack
+from .gpkg import get_gpkg_fingerprint
+from .reader import GpkgReader, GpkgQueryError
+from .profiling import profile_stage
+from .schema import MUKEY_DTYPE, to_mukeys, to_rating_dtype
+
+"""Rating tables (main.rating_<variable>, one mukey + value table per variable) of the state gpkgs."""
+
+
+def read_rating_tables(gpkg_path, rating_tables, mukeys=None, cache_path=None, reader=None, state=None):
+    """Read all rating tables of a gpkg into one wide table indexed by mukey, one column per rating.
+
+    The gpkg is read through reader (a GpkgReader, a private one if None): the queries of all
+    tables are submitted at once and select only mukey and the rating value, then all columns
+    are assembled in one concat instead of merging the tables one by one.
+    If mukeys is given (the mukeys hit by the points), every query is filtered against them, so
+    only the rows needed leave sqlite.
+    If cache_path is given, ratings are served from that cache and only rating tables not cached
+    yet are read from the gpkg (see open_rating_cache).
+    A table that can't be read gives an all-null column.
+    Values are cast to their schema types (see ssurgo_core.schema) as they leave sqlite, the
+    index is the int32 mukey.
+    Every gpkg query is profiled in the reader thread as 'gpkg_query' with state and table, a read
+    from the cache as 'read_cached_rating'.
+    """
+    columns = []
+    with ExitStack() as stack:
+        if reader is None:
+            reader = stack.enter_context(GpkgReader())
+        if cache_path:
+            conn = stack.enter_context(closing(open_rating_cache(cache_path, gpkg_path)))
+            fill_rating_cache(conn, reader, gpkg_path, rating_tables, state)
+            if mukeys is not None:
+                load_mukey_filter(conn, mukeys)
+        else:
+            # the point mukeys go in as one json array parameter, sqlite builds a temp index for the IN
+            mukey_filter = 'WHERE CAST(mukey AS INTEGER) IN (SELECT value FROM json_each(?))' if mukeys is not None else ''
+            params = (json.dumps(np.unique(mukeys).tolist()),) if mukeys is not None else ()
+            queries = {table_name: reader.submit(gpkg_path, f'SELECT mukey, "{get_rating_name(table_name)}" '
+                                                            f'FROM {table_name} {mukey_filter}', params,
+                                                 labels={'state': state, 'table': get_rating_name(table_name)})
+                       for table_name in rating_tables}
+
+        for table_name in rating_tables:
+            rating = get_rating_name(table_name)
+            try:
+                if cache_path:
+                    with profile_stage('read_cached_rating', table=rating) as record:
+                        rows = read_cached_rating(conn, rating, filter_points=mukeys is not None)
+                        record['rows_out'] = len(rows)
+                else:
+                    rows = queries[table_name].result()
+            except GpkgQueryError as e:
+                print(f"   WARNING: Could not read table '{table_name}' with sqlite3. {e}")
+                continue
+            column = to_rating_dtype(pd.Series([row[1] for row in rows], name=rating, dtype=object))
+            column.index = to_mukeys([row[0] for row in rows])
+            column = column[column.index.notna() & ~column.index.duplicated()]
+            column.index = column.index.astype(MUKEY_DTYPE)
+            columns.append(column)
+
+    ratings_df = pd.concat(columns, axis=1) if columns else pd.DataFrame(index=pd.Index([], dtype=MUKEY_DTYPE))
+    ratings_df = ratings_df.reindex(columns=[get_rating_name(t) for t in rating_tables])
+    ratings_df.index.name = 'mukey'
+    return ratings_df
+
+
+def open_rating_cache(cache_path, gpkg_path):
+    """Open the local rating cache of one state gpkg.
+
+    The cache holds the full (mukey, value) column of every rating table read so far. It is keyed
+    by the gpkg path and fingerprint and is emptied when either changes, e.g. after the SSURGO
+    Portal re-exports the state.
+    """
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    conn = sqlite3.connect(cache_path)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS cache_info (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS cached_ratings (rating TEXT PRIMARY KEY);
+        CREATE TABLE IF NOT EXISTS rating_values (
+            rating TEXT, mukey INTEGER, value, PRIMARY KEY (rating, mukey)) WITHOUT ROWID;
+    """)
+    source = {'gpkg_path': os.path.abspath(gpkg_path), 'fingerprint': get_gpkg_fingerprint(gpkg_path)}
+    if dict(conn.execute('SELECT key, value FROM cache_info').fetchall()) != source:
+        print(f'   rating cache is stale or new, rebuilding {os.path.basename(cache_path)}')
+        with conn:
+            conn.execute('DELETE FROM cache_info')
+            conn.execute('DELETE FROM cached_ratings')
+            conn.execute('DELETE FROM rating_values')
+            conn.executemany('INSERT INTO cache_info VALUES (?, ?)', source.items())
+    return conn
+
+
+def fill_rating_cache(conn, reader, gpkg_path, rating_tables, state=None):
+    # the full column of every rating not cached yet, read from the gpkg at the same time
+    cached = {row[0] for row in conn.execute('SELECT rating FROM cached_ratings')}
+    queries = {rating: reader.submit(gpkg_path, f'SELECT CAST(mukey AS INTEGER), "{rating}" FROM {table_name} '
+                                                'WHERE CAST(mukey AS INTEGER) > 0', labels={'state': state, 'table': rating})
+               for rating, table_name in ((get_rating_name(t), t) for t in rating_tables) if rating not in cached}
+    for rating, query in queries.items():
+        try:
+            rows = query.result()
+        except GpkgQueryError as e:
+            print(f"   WARNING: Could not read rating '{rating}' with sqlite3. {e}")
+            continue
+        with profile_stage('write_rating_cache', table=rating, rows_in=len(rows)), conn:
+            conn.executemany('INSERT OR IGNORE INTO rating_values VALUES (?, ?, ?)', ((rating, *row) for row in rows))
+            conn.execute('INSERT INTO cached_ratings VALUES (?)', (rating,))
+
+
+def read_cached_rating(conn, rating, filter_points):
+    mukey_filter = 'AND mukey IN (SELECT mukey FROM temp.point_mukeys)' if filter_points else ''
+    return conn.execute(f'SELECT mukey, value FROM rating_values WHERE rating = ? {mukey_filter}',
+                        (rating,)).fetchall()
+
+
+def load_mukey_filter(conn, mukeys):
+    # INTEGER PRIMARY KEY makes the temp table its own index for the IN lookups
+    conn.execute('CREATE TEMP TABLE point_mukeys (mukey INTEGER PRIMARY KEY)')
+    conn.executemany('INSERT INTO temp.point_mukeys VALUES (?)', ((int(k),) for k in np.unique(mukeys)))
+
+
+def get_rating_name(table_name):
+    return table_name.replace('main.rating_', '')
+
+
+def load_rating_availability(csv_path):
+    """Availability matrix from step 02: boolean DataFrame, one row per rating table, one column per state.
+
+    Accepts both the boolean table and the older 'yes'/empty table.
+    """
+    df = pd.read_csv(csv_path, index_col='rating_tables')
+    availability = df.astype(str).apply(lambda col: col.str.strip().str.lower()).isin(['yes', 'true'])
+
+    rating_tables_from_csv = availability.index.tolist()
+
+    return availability, rating_tables_from_csv
+
+
+def build_read_plan(availability, rating_tables, state):
+    """Rating tables to query for a state: those step 02 found in its gpkg.
+
+    Without an availability table, for a state not in it, or for a table not in it
+    (inventory older than RATING_TABLES) the table is read anyway.
+    """
+    if availability is None or state not in availability.columns:
+        return list(rating_tables)
+    state_availability = availability[state].reindex(rating_tables, fill_value=True)
+    read_plan = state_availability.index[state_availability].tolist()
+    if len(read_plan) < len(rating_tables):
+        print(f"   {state}: skipping {len(rating_tables) - len(read_plan)} rating tables not in its gpkg")
+    return read_plan
@@ -0,0 +1,103 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from .gpkg import connect_gpkg
+from .profiling import profile_stage
+
+"""
+Shared reader for the state gpkgs, used by steps 02, 03 and 04.
+
+    with GpkgReader(max_workers=8) as reader:
+        futures = [reader.submit(gpkg_path, 'SELECT ...') for gpkg_path in gpkg_paths]
+        rows = [future.result() for future in futures]   # or reader.query(...) to wait right away
+
+One read-only, immutable connection per gpkg, opened on first use and kept until close, so the
+tables of a gpkg share a connection instead of opening one each. Queries submitted for different
+gpkgs run at the same time on the thread pool (sqlite releases the GIL), which overlaps the
+latency of the network share; queries on the same gpkg take turns on its connection.
+Every query has a time limit (sqlite progress handler) and a failed or timed out query raises
+GpkgQueryError with the gpkg, the sql and the sqlite error.
+A query given labels (e.g. state=, table=) is recorded as a 'gpkg_query' profile stage in the
+thread that runs it, the labels of the caller's stages don't reach the pool threads.
+"""
+
+QUERY_TIMEOUT = 600  # seconds per query, None for no limit
+PROGRESS_STEPS = 10_000  # sqlite VM instructions between time limit checks
+
+
+class GpkgQueryError(Exception):
+    def __init__(self, gpkg_path, sql, error, timed_out=False):
+        self.gpkg_path = gpkg_path
+        self.sql = sql
+        self.error = error
+        self.timed_out = timed_out
+        reason = 'timed out' if timed_out else f'failed: {error}'
+        super().__init__(f"query on {os.path.basename(gpkg_path)} {reason} ({' '.join(sql.split())[:200]})")
+
+
+class GpkgReader:
+    def __init__(self, max_workers=8, timeout=QUERY_TIMEOUT):
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gpkg_reader')
+        self._connections = {}  # gpkg path -> (connection, lock)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _get_connection(self, gpkg_path):
+        key = os.path.abspath(gpkg_path)
+        with self._lock:
+            if key not in self._connections:
+                conn = connect_gpkg(gpkg_path, immutable=True, check_same_thread=False)
+                self._connections[key] = (conn, threading.Lock())
+            return self._connections[key]
+
+    def query(self, gpkg_path, sql, params=(), timeout=None, labels=None):
+        """Run one query on the gpkg and return all its rows, profiled with labels if given."""
+        with profile_stage('gpkg_query', **labels) if labels is not None else nullcontext({}) as record:
+            rows = self._query(gpkg_path, sql, params, timeout)
+            record['rows_out'] = len(rows)
+        return rows
+
+    def _query(self, gpkg_path, sql, params, timeout):
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            conn, conn_lock = self._get_connection(gpkg_path)
+        except sqlite3.Error as e:
+            raise GpkgQueryError(gpkg_path, sql, e) from e
+
+        with conn_lock:
+            deadline = time.monotonic() + timeout if timeout else None
+            if deadline is not None:
+                # returning True from the handler interrupts the query
+                conn.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_STEPS)
+            try:
+                return conn.execute(sql, params).fetchall()
+            except sqlite3.Error as e:
+                timed_out = deadline is not None and time.monotonic() > deadline and 'interrupt' in str(e)
+                raise GpkgQueryError(gpkg_path, sql, e, timed_out) from e
+            finally:
+                conn.set_progress_handler(None, 0)
+
+    def submit(self, gpkg_path, sql, params=(), timeout=None, labels=None):
+        """Queue a query on the thread pool, returns a Future of its rows."""
+        return self._pool.submit(self.query, gpkg_path, sql, params, timeout, labels)
+
+    def table_names(self, gpkg_path, prefix=''):
+        rows = self.query(gpkg_path, "SELECT name FROM sqlite_master WHERE type = 'table' AND substr(name, 1, ?) = ? "
+                                     "ORDER BY name", (len(prefix), prefix))
+        return [row[0] for row in rows]
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        with self._lock:
+            for conn, _ in self._connections.values():
+                conn.close()
+            self._connections.clear()
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from . import PRIMARY_KEY_FIELD
+
+"""
+Column types of the ratings tables, from the sqlite read in step 04 to the step 05 outputs.
+
+- mukey: int32 (SSURGO mukeys are well below 2**31), nullable Int32 where a point may have none
+- state and the text ratings (ecosite id/name): categorical, a few hundred distinct values
+- every other rating: float32, ratings are published with a few significant digits so float32
+  (~7 digits) holds them exactly enough and halves the memory of float64
+PrimaryKey keeps the type it has in the points layer.
+"""
+
+MUKEY_DTYPE = np.int32
+NULLABLE_MUKEY_DTYPE = 'Int32'
+RATING_DTYPE = np.float32
+TEXT_RATINGS = ['EcoSiteID_DCD', 'EcoSiteNm_DCD']  # rating tables with text values, everything else is numeric
+CATEGORY_COLUMNS = ['state', *TEXT_RATINGS]
+
+ARROW_TYPES = {'mukey': pa.int32(), **{col: pa.dictionary(pa.int32(), pa.string()) for col in CATEGORY_COLUMNS}}
+ARROW_RATING_TYPE = pa.float32()
+
+
+def to_mukeys(values):
+    """mukeys (text, float with NaN, ...) as a nullable Int32 array, anything not a number becomes <NA>."""
+    return pd.array(pd.to_numeric(pd.Series(values), errors='coerce'), dtype=NULLABLE_MUKEY_DTYPE)
+
+
+def to_rating_dtype(column):
+    if column.name in CATEGORY_COLUMNS:
+        return column.astype('string').astype('category')
+    return pd.to_numeric(column, errors='coerce').astype(RATING_DTYPE)
+
+
+def apply_schema(df):
+    """Cast the columns of a ratings frame to their schema types, in place, returns df."""
+    for col in df.columns:
+        if col == 'mukey':
+            df[col] = df[col].astype(NULLABLE_MUKEY_DTYPE if df[col].isna().any() else MUKEY_DTYPE)
+        elif col != PRIMARY_KEY_FIELD:
+            df[col] = to_rating_dtype(df[col])
+    return df
+
+
+def arrow_schema(schema):
+    """The schema types for the columns of an arrow schema (e.g. of a table read from parquet)."""
+    return pa.schema([pa.field(field.name, get_arrow_type(field)) for field in schema])
+
+
+def get_arrow_type(field):
+    if field.name == PRIMARY_KEY_FIELD:
+        return field.type
+    return ARROW_TYPES.get(field.name, ARROW_RATING_TYPE)
@@ -0,0 +1,124 @@
+import os
+import numpy as np
+from contextlib import closing
+from . import PRIMARY_KEY_FIELD
+from .gpkg import connect_gpkg, get_geometry_column, get_layer_crs, get_rtree_name, gpkg_blob_to_wkb
+from .lazy import gpd, pyogrio, shapely
+from .profiling import profile_stage
+from .schema import MUKEY_DTYPE, to_mukeys
+
+
+def load_points(points_fc):
+    """Read a point layer given as <gdb or gpkg>/<layer>, e.g. the nri points."""
+    gdb_parent = os.path.dirname(points_fc)
+    layer_name = os.path.basename(points_fc)
+    return gpd.read_file(gdb_parent, layer=layer_name)
+
+
+def read_point_fields(points_fc):
+    """Field names of a point layer, without reading its features."""
+    return list(pyogrio.read_info(os.path.dirname(points_fc), layer=os.path.basename(points_fc))['fields'])
+
+
+def load_point_states(points_fc):
+    """PrimaryKey -> STATE_NAME of the points, without reading their geometry; None if they have no STATE_NAME."""
+    if 'STATE_NAME' not in read_point_fields(points_fc):
+        return None
+    df = gpd.read_file(os.path.dirname(points_fc), layer=os.path.basename(points_fc),
+                       columns=[PRIMARY_KEY_FIELD, 'STATE_NAME'], ignore_geometry=True)
+    return df.set_index(PRIMARY_KEY_FIELD)['STATE_NAME']
+
+
+def spatial_join(points_gdf, gpkg_path, soil_poly):
+    """Point-in-polygon join of nri points against MUPOLYGON (replaces arcpy SpatialJoin).
+
+    The points are projected to the CRS of the soil layer first (see to_layer_crs).
+    Only the polygons whose envelope holds a point are read (see read_mupolygons), their
+    envelopes are bulk loaded into an STRtree and all points are queried in one vectorized call.
+    Like JOIN_ONE_TO_ONE, a point on a shared boundary keeps one match, the polygon with the lowest rowid.
+    Returns (PrimaryKey, mukey) arrays for the matched points only.
+    """
+    return spatial_join_many({None: points_gdf}, gpkg_path, soil_poly)[None]
+
+
+def spatial_join_many(point_sets, gpkg_path, soil_poly):
+    """spatial_join for several point layers ({name: points_gdf}) with one read of the polygons.
+
+    The polygons holding a point of any set are read and indexed once, then every set is queried
+    against the same tree. Returns {name: (PrimaryKey, mukey)}.
+    """
+    with closing(connect_gpkg(gpkg_path, immutable=True)) as conn:
+        layer_crs = get_layer_crs(conn, soil_poly)
+    point_sets = {name: to_layer_crs(points_gdf, layer_crs, name) for name, points_gdf in point_sets.items()}
+    all_points = np.concatenate([points_gdf.geometry.values for points_gdf in point_sets.values()])
+    poly_mukeys, polygons = read_mupolygons(gpkg_path, soil_poly, points=all_points)
+    tree = shapely.STRtree(polygons)
+    joins = {}
+    for name, points_gdf in point_sets.items():
+        with profile_stage('spatial_join', rows_in=len(points_gdf), **({'point_set': name} if name else {})) as record:
+            point_idx, poly_idx = tree.query(points_gdf.geometry.values, predicate='intersects')
+
+            # hits come in tree order, sort by point then polygon so a point on a shared boundary
+            # always keeps the polygon read first (lowest rowid), whatever else is in the tree
+            order = np.lexsort((poly_idx, point_idx))
+            point_idx, poly_idx = point_idx[order], poly_idx[order]
+            first = np.unique(point_idx, return_index=True)[1]
+            point_idx, poly_idx = point_idx[first], poly_idx[first]
+
+            # polygons without a valid mukey count as no match
+            has_mukey = ~poly_mukeys[poly_idx].isna()
+            point_idx, poly_idx = point_idx[has_mukey], poly_idx[has_mukey]
+
+            primary_keys = points_gdf[PRIMARY_KEY_FIELD].array[point_idx]  # keeps the points' key type, also when empty
+            mukeys = poly_mukeys[poly_idx].to_numpy(dtype=MUKEY_DTYPE)
+            record['rows_out'] = len(primary_keys)
+        print(f"   {len(primary_keys)} of {len(points_gdf)}{f' {name}' if name else ''} points joined to {len(polygons)} polygons")
+        joins[name] = (primary_keys, mukeys)
+    return joins
+
+
+def to_layer_crs(points_gdf, layer_crs, name=None):
+    """The points in layer_crs, projected on the fly like arcpy did; raises if the points have no CRS to project from."""
+    if layer_crs is None or points_gdf.crs == layer_crs:
+        return points_gdf
+    if points_gdf.crs is None:
+        raise ValueError(f"{name or 'the'} points have no CRS, the soil polygons are in {layer_crs}")
+    return points_gdf.to_crs(layer_crs)
+
+
+def read_mupolygons(gpkg_path, soil_poly, points=None):
+    """Read mukey (nullable Int32) and geometry of the polygons in the soil layer straight from the gpkg, in rowid order.
+
+    Without points every polygon is read. With points, the gpkg rtree index (rtree_<layer>_<geom>)
+    is joined with the point coordinates in sqlite, and only the blobs of polygons whose envelope
+    holds a point are fetched and decoded. The gpkgs reach well past the state border, so most
+    polygons of a state are never hit. Falls back to reading every polygon if there is no rtree.
+    """
+    with profile_stage('read_mupolygons', table=soil_poly) as record, \
+            closing(connect_gpkg(gpkg_path, immutable=True)) as conn:
+        geom_col = get_geometry_column(conn, soil_poly)
+        rtree_name = get_rtree_name(conn, soil_poly, geom_col) if points is not None else None
+        if rtree_name:
+            load_point_coordinates(conn, points)
+            # rtree boxes are rounded outward to float32, so no polygon holding a point is missed
+            rows = conn.execute(f'''
+                SELECT mukey, "{geom_col}" FROM "{soil_poly}" WHERE rowid IN (
+                    SELECT r.id FROM temp.points p JOIN "{rtree_name}" r
+                    ON r.minx <= p.x AND r.maxx >= p.x AND r.miny <= p.y AND r.maxy >= p.y)
+                AND "{geom_col}" IS NOT NULL ORDER BY rowid''').fetchall()
+        else:
+            if points is not None:
+                print(f'   no spatial index on {soil_poly}, reading all polygons')
+            rows = conn.execute(
+                f'SELECT mukey, "{geom_col}" FROM "{soil_poly}" WHERE "{geom_col}" IS NOT NULL ORDER BY rowid').fetchall()
+
+        mukeys = to_mukeys([row[0] for row in rows])
+        polygons = shapely.from_wkb([gpkg_blob_to_wkb(row[1]) for row in rows])
+        record['rtree'] = bool(rtree_name)
+        record['rows_out'] = len(polygons)
+    return mukeys, polygons
+
+
+def load_point_coordinates(conn, points):
+    conn.execute('CREATE TEMP TABLE points (x REAL, y REAL)')
+    conn.executemany('INSERT INTO temp.points VALUES (?, ?)', shapely.get_coordinates(points).tolist())
@@ -0,0 +1,135 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from . import PRIMARY_KEY_FIELD
+from .pipeline import fingerprint_path
+
+"""
+Memory-mapped column store of a ratings parquet (step 04 national table, step 05 combined table)
+for looking up a few points or mukeys without loading the whole table.
+
+    store = PointStore(store_dir)
+    store.lookup(['000123', '004567'], columns=['Clay_WA_SL', 'state'])   # by PrimaryKey
+    store.lookup_mukeys([123456])                                        # every point on these mukeys (step 04 store)
+    clay = store.column('Clay_WA_SL')                                     # memory mapped, no copy
+
+<store_dir> holds one fixed-width .npy per column (text columns as int32 codes + categories in
+store.json, text keys as fixed-width unicode) and, for PrimaryKey and mukey, the row order that
+sorts the key (<key>.order.npy) with the sorted keys (<key>.sorted.npy), so a lookup is a
+binary search. Only the key columns the parquet has are indexed: the step 05 combined table has
+PrimaryKey and the ratings but no mukey, so its store has no lookup_mukeys.
+The store records the fingerprint of its parquet and is rebuilt when it changes.
+"""
+
+KEY_COLUMNS = [PRIMARY_KEY_FIELD, 'mukey']
+STORE_INFO = 'store.json'
+
+
+def build_store(parquet_path, store_dir):
+    """Write the store of parquet_path to store_dir, one column in memory at a time; skipped if up to date."""
+    fingerprint = fingerprint_path(parquet_path)
+    info_path = os.path.join(store_dir, STORE_INFO)
+    if os.path.exists(info_path):
+        with open(info_path) as f:
+            if json.load(f).get('fingerprint') == fingerprint:
+                print(f'store {store_dir} is up to date')
+                return store_dir
+
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.makedirs(store_dir)
+    parquet_file = pq.ParquetFile(parquet_path)
+    columns = {}
+    for name in parquet_file.schema_arrow.names:
+        column = parquet_file.read(columns=[name]).column(0)
+        if pa.types.is_dictionary(column.type):
+            column = column.unify_dictionaries()  # row groups (states) have their own dictionaries
+        column = column.combine_chunks()
+        values, columns[name] = to_fixed_width(column)
+        np.save(os.path.join(store_dir, f'{name}.npy'), values)
+        if name in KEY_COLUMNS:
+            order = np.argsort(values, kind='stable').astype(np.int64)
+            np.save(os.path.join(store_dir, f'{name}.order.npy'), order)
+            np.save(os.path.join(store_dir, f'{name}.sorted.npy'), values[order])
+
+    # store.json is written last, a half built store has none and is rebuilt
+    with open(info_path, 'w') as f:
+        json.dump({'source': os.path.abspath(parquet_path), 'fingerprint': fingerprint,
+                   'n_rows': parquet_file.metadata.num_rows, 'columns': columns}, f, indent=1)
+    print(f'store {store_dir}: {parquet_file.metadata.num_rows} rows, {len(columns)} columns')
+    return store_dir
+
+
+def to_fixed_width(column):
+    # returns the numpy values and the column info for store.json
+    if pa.types.is_dictionary(column.type):
+        return column.indices.fill_null(-1).to_numpy().astype(np.int32), \
+            {'kind': 'category', 'categories': column.dictionary.to_pylist()}
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        return column.fill_null('').to_numpy(zero_copy_only=False).astype(str), {'kind': 'text'}
+    if pa.types.is_integer(column.type) and column.null_count:
+        return column.to_numpy(zero_copy_only=False).astype(np.float64), {'kind': 'number'}  # nulls as NaN
+    return column.to_numpy(zero_copy_only=False), {'kind': 'number'}
+
+
+class PointStore:
+    """Read side of a store written by build_store, arrays are memory mapped on first use."""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, STORE_INFO)) as f:
+            info = json.load(f)
+        self.n_rows = info['n_rows']
+        self.columns = info['columns']
+        self._arrays = {}
+
+    def __repr__(self):
+        return f'PointStore({self.store_dir!r}, {self.n_rows} rows, {len(self.columns)} columns)'
+
+    def _load(self, filename):
+        if filename not in self._arrays:
+            self._arrays[filename] = np.load(os.path.join(self.store_dir, filename), mmap_mode='r')
+        return self._arrays[filename]
+
+    def column(self, name):
+        """The stored values of a column, memory mapped (category columns as codes, see decode)."""
+        return self._load(f'{name}.npy')
+
+    def decode(self, name, values):
+        if self.columns[name]['kind'] == 'category':
+            return pd.Categorical.from_codes(values, categories=self.columns[name]['categories'])
+        return values
+
+    def find_rows(self, key, values):
+        """Row numbers of values in a key column by binary search, (rows, index into values) of the hits."""
+        if key not in KEY_COLUMNS or key not in self.columns:
+            indexed = [name for name in KEY_COLUMNS if name in self.columns]
+            raise KeyError(f"{key} is not an indexed key of {self.store_dir}, its keys are {', '.join(indexed)}")
+        sorted_keys = self._load(f'{key}.sorted.npy')
+        values = np.asarray(values)
+        keys = values.astype(sorted_keys.dtype)
+        start = np.searchsorted(sorted_keys, keys, side='left')
+        stop = np.searchsorted(sorted_keys, keys, side='right')
+        # a value that doesn't survive the cast (too long for the fixed width, fractional mukey) is not in the store
+        counts = np.where(keys == values, stop - start, 0)
+        # expand each [start, stop) range, a key like mukey can have many rows
+        value_index = np.repeat(np.arange(len(values)), counts)
+        positions = np.repeat(start - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return np.asarray(self._load(f'{key}.order.npy')[positions]), value_index
+
+    def rows(self, row_numbers, columns=None):
+        row_numbers = np.sort(row_numbers)
+        columns = columns or list(self.columns)
+        return pd.DataFrame({name: self.decode(name, np.asarray(self.column(name)[row_numbers])) for name in columns},
+                            index=pd.Index(row_numbers, name='row'))
+
+    def lookup(self, primary_keys, columns=None):
+        """Rows of the given PrimaryKeys (missing keys are left out)."""
+        return self.rows(self.find_rows(PRIMARY_KEY_FIELD, primary_keys)[0], columns)
+
+    def lookup_mukeys(self, mukeys, columns=None):
+        """All rows on the given mukeys."""
+        return self.rows(self.find_rows('mukey', mukeys)[0], columns)
@@ -0,0 +1,99 @@
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+from contextlib import closing
+from . import PRIMARY_KEY_FIELD
+from .gpkg import SOIL_POLY, state_gpkg_path
+from .lazy import gpd, shapely
+
+"""
+Synthetic SSURGO-like inputs for benchmarks (see benchmark.py), so the pipeline can be timed on
+any machine without the real state gpkgs or ArcGIS:
+- state gpkgs laid out like the portal export (<dir>/<state>_gpkg/<state>.gpkg) with a MUPOLYGON
+  layer (irregular voronoi cells, text mukey, rtree spatial index) and main.rating_<variable>
+  tables keyed by mukey, with some null values and some mukeys without a rating
+- nri-like points with PrimaryKey and STATE_NAME
+Neighbouring states overlap by STATE_OVERLAP, like the real gpkgs that don't follow state borders.
+"""
+
+CRS = 'EPSG:5070'  # CONUS Albers, like the projected nri points
+STATE_SIZE = 300_000.  # m, side of a square synthetic state
+STATE_OVERLAP = 5_000.  # m, each gpkg reaches this far into its neighbours
+POLYGONS_PER_MUKEY = 5  # map units are made of several polygons
+NULL_FRACTION = 0.1  # ratings with a null value
+UNRATED_FRACTION = 0.05  # mukeys missing from a rating table
+
+
+def make_state_gpkgs(gpkg_dir, n_states, n_polygons, vertices_per_polygon, rating_variables, text_variables=(), seed=0):
+    """Write n_states state gpkgs side by side, returns {state: (xmin, ymin, xmax, ymax)} of the states."""
+    rng = np.random.default_rng(seed)
+    bounds = {}
+    for i in range(n_states):
+        state = f'State{i + 1:02d}'
+        bounds[state] = (i * STATE_SIZE, 0., (i + 1) * STATE_SIZE, STATE_SIZE)
+        gpkg_path = state_gpkg_path(state, gpkg_dir)
+        os.makedirs(os.path.dirname(gpkg_path), exist_ok=True)
+        if os.path.exists(gpkg_path):
+            os.remove(gpkg_path)
+        xmin, ymin, xmax, ymax = bounds[state]
+        gpkg_bounds = (xmin - STATE_OVERLAP, ymin, xmax + STATE_OVERLAP, ymax)
+        mukeys = write_mupolygon(gpkg_path, gpkg_bounds, n_polygons, vertices_per_polygon, first_mukey=(i + 1) * 1_000_000, rng=rng)
+        write_rating_tables(gpkg_path, np.unique(mukeys), rating_variables, text_variables, rng)
+        print(f'   {state}: {n_polygons} polygons, {len(np.unique(mukeys))} mukeys, {os.path.getsize(gpkg_path) / 1e6:.1f} MB')
+    return bounds
+
+
+def write_mupolygon(gpkg_path, bounds, n_polygons, vertices_per_polygon, first_mukey, rng):
+    xmin, ymin, xmax, ymax = bounds
+    seeds = np.column_stack([rng.uniform(xmin, xmax, n_polygons), rng.uniform(ymin, ymax, n_polygons)])
+    extent = shapely.box(*bounds)
+    cells = shapely.get_parts(shapely.voronoi_polygons(shapely.multipoints(seeds), extend_to=extent))
+    cells = shapely.intersection(cells, extent)
+    # densify the edges to about vertices_per_polygon vertices, soil polygons are far from convex hulls
+    cells = shapely.segmentize(cells, np.maximum(shapely.length(cells) / vertices_per_polygon, 1.))
+
+    mukeys = first_mukey + rng.integers(0, max(1, n_polygons // POLYGONS_PER_MUKEY), len(cells))
+    gdf = gpd.GeoDataFrame({'mukey': mukeys.astype(str)}, geometry=cells, crs=CRS)  # mukey is text in the portal gpkgs
+    gdf.to_file(gpkg_path, layer=SOIL_POLY, driver='GPKG')  # GDAL adds the rtree_MUPOLYGON_geom index
+    return mukeys
+
+
+def write_rating_tables(gpkg_path, mukeys, rating_variables, text_variables, rng):
+    with closing(sqlite3.connect(gpkg_path)) as conn, conn:
+        for var in [*rating_variables, *text_variables]:
+            rated = mukeys[rng.random(len(mukeys)) >= UNRATED_FRACTION]
+            if var in text_variables:
+                values = np.array([f'R{code:03d}XY{code % 50:03d}CA' for code in rng.integers(0, 400, len(rated))], dtype=object)
+            else:
+                values = rng.gamma(2., 10., len(rated)).round(2).astype(object)
+            values[rng.random(len(rated)) < NULL_FRACTION] = None
+            sql_type = 'TEXT' if var in text_variables else 'REAL'
+            conn.execute(f'CREATE TABLE "rating_{var}" (mukey TEXT, "{var}" {sql_type})')
+            conn.executemany(f'INSERT INTO "rating_{var}" VALUES (?, ?)', zip(rated.astype(str), values))
+
+
+def make_points(points_gpkg, layer, state_bounds, n_points, seed=0):
+    """Write n_points random points spread over the states, returns the layer path <gpkg>/<layer>."""
+    rng = np.random.default_rng(seed)
+    states = list(state_bounds)
+    state_index = rng.integers(0, len(states), n_points)
+    bounds = np.array([state_bounds[state] for state in states])[state_index]
+    x = rng.uniform(bounds[:, 0], bounds[:, 2])
+    y = rng.uniform(bounds[:, 1], bounds[:, 3])
+    gdf = gpd.GeoDataFrame({PRIMARY_KEY_FIELD: [f'{i:09d}' for i in range(n_points)],
+                            'STATE_NAME': np.array(states)[state_index]},
+                           geometry=gpd.points_from_xy(x, y), crs=CRS)
+    os.makedirs(os.path.dirname(os.path.abspath(points_gpkg)), exist_ok=True)
+    if os.path.exists(points_gpkg):
+        os.remove(points_gpkg)
+    gdf.to_file(points_gpkg, layer=layer, driver='GPKG')
+    return os.path.join(points_gpkg, layer)
+
+
+def make_solus(primary_keys, solus_variables, seed=0):
+    """SOLUS-like values for the points, indexed by PrimaryKey, with a few gaps."""
+    rng = np.random.default_rng(seed)
+    values = rng.gamma(2., 50., (len(primary_keys), len(solus_variables)))
+    values[rng.random(values.shape) < NULL_FRACTION / 2] = np.nan
+    return pd.DataFrame(values, columns=solus_variables, index=pd.Index(primary_keys, name=PRIMARY_KEY_FIELD))